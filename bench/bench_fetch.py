@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Benchmark: gcal.fetch_events() against a local fake of events.list.
+
+Five years of events, more than one result page per year, and a fixed
+latency per page. The windows are fetched concurrently, so the wall clock
+time should be close to one year's worth of pages, not all of them.
+
+    python bench/bench_fetch.py [events_per_year] [latency_seconds]
+
+"""
+import os, sys, datetime, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import gcal
+from fakegcal import FakeCalendarService, synthetic_events, TIMED
+
+def main():
+    per_year = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    years = range(2015, 2020)
+    service = FakeCalendarService({'bench': synthetic_events(per_year, years, mix=TIMED)}, latency=latency)
+    timeMin, timeMax = datetime.datetime(years[0], 1, 1), datetime.datetime(years[-1]+1, 1, 1)
+
+    t0 = time.time()
+    serial = gcal.list_all(service, calendarId='bench', singleEvents=True, orderBy='startTime',
+                           maxResults=gcal.MAX_RESULTS,
+                           timeMin=gcal.rfc3339(timeMin), timeMax=gcal.rfc3339(timeMax))
+    t_serial, serial_requests = time.time() - t0, service.requests
+
+    service.requests = 0
+    t0 = time.time()
+    windowed = gcal.fetch_events(service, 'bench', timeMin, timeMax)
+    t_windowed = time.time() - t0
+
+    assert [e['id'] for e in serial] == [e['id'] for e in windowed]
+    print('%i events over %i years, %.0f ms per page' % (len(windowed), len(years), latency * 1000))
+    print('  one range, serial pages:     %6.0f ms, %i requests' % (t_serial * 1000, serial_requests))
+    print('  year windows, concurrently:  %6.0f ms, %i requests' % (t_windowed * 1000, service.requests))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure what main.py costs a cold instance: imports, the Calendar service and template compiling.
+
+Every step is timed in a fresh interpreter. Run from the repository root,
+with the packages from appengine_requirements.txt installed:
+
+    python bench/bench_import.py [repeat]
+
+"""
+import os, sys, subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STEPS = [
+    ('import requests, requests_oauthlib, trello, requests_toolbelt',
+     'import requests\n'
+     'from requests_oauthlib import OAuth1Session\n'
+     'from trello import TrelloClient\n'
+     'from requests_toolbelt.adapters import appengine'),
+    ('import apiclient.discovery',
+     'from apiclient.discovery import build_from_document'),
+    ('Calendar service from bundled discovery document',
+     'from apiclient.discovery import build_from_document\n'
+     '~'
+     'import httplib2\n'
+     'with open("discovery/calendar-v3.json") as f:\n'
+     '    build_from_document(f.read(), http=httplib2.Http())'),
+    ('compile calendar.html and month.html',
+     'import rendering\n'
+     '~'
+     'rendering.JINJA_ENVIRONMENT.get_template("templates/calendar.html")\n'
+     'rendering.JINJA_ENVIRONMENT.get_template("templates/month.html")'),
+    # rendering.MemcacheBytecodeCache, with a dict in place of memcache: this is the
+    # bytecode load and unmarshal of a warm memcache, without the memcache round trip
+    ('load calendar.html and month.html from MemcacheBytecodeCache (dict memcache stand-in)',
+     'import rendering\n'
+     'class DictMemcache(dict):\n'
+     '    def get(self, key, namespace=None): return dict.get(self, (namespace, key))\n'
+     '    def set(self, key, value, namespace=None): self[(namespace, key)] = value\n'
+     'rendering.memcache = DictMemcache()\n'
+     'rendering.JINJA_ENVIRONMENT.bytecode_cache = rendering.MemcacheBytecodeCache()\n'
+     'rendering.JINJA_ENVIRONMENT.get_template("templates/calendar.html")\n'
+     'rendering.JINJA_ENVIRONMENT.get_template("templates/month.html")\n'
+     'rendering.JINJA_ENVIRONMENT.cache.clear()\n'
+     '~'
+     'rendering.JINJA_ENVIRONMENT.get_template("templates/calendar.html")\n'
+     'rendering.JINJA_ENVIRONMENT.get_template("templates/month.html")'),
+]
+
+# code before '~' is setup, the rest is timed
+TIMER = '''
+import time
+%s
+_t0 = time.time()
+%s
+print(time.time() - _t0)
+'''
+
+def measure(code, repeat):
+    setup, _, timed = code.rpartition('~')
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', TIMER % (setup, timed)], cwd=ROOT)
+        times.append(float(out.strip()))
+    return min(times)
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for (name, code) in STEPS:
+        print('%8.1f ms  %s' % (measure(code, repeat) * 1000, name))
+
+if __name__ == '__main__':
+    main()
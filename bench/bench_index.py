@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Microbenchmark: per-day event lookup in YearCalendar, linear scan vs date index.
+
+Run from the repository root:
+
+    python bench/bench_index.py [number_of_events]
+
+"""
+import os, sys, datetime, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from yearcal import YearCalendar
+from fakegcal import synthetic_events, ALL_DAY
+
+def linear_get_events(yc, date):
+    "the old lookup: scan every event for every day"
+    return [E for (evdate, E) in yc.events if evdate == date]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    yc = YearCalendar('bench', synthetic_events(count, years=(2016,), mix=ALL_DAY))
+    start, end = datetime.date(2016, 1, 1), datetime.date(2017, 1, 1)
+    days = [start + datetime.timedelta(days=n) for n in range((end - start).days)]
+
+    def linear():
+        for d in days:
+            linear_get_events(yc, d)
+    def indexed():
+        for d in days:
+            yc.get_events(d)
+
+    assert all(linear_get_events(yc, d) == yc.get_events(d) for d in days)
+    repeat = 3
+    t_linear = min(timeit.repeat(linear, number=1, repeat=repeat))
+    t_indexed = min(timeit.repeat(indexed, number=1, repeat=repeat))
+    t_dates = min(timeit.repeat(lambda: list(yc.dates(start, end)), number=1, repeat=repeat))
+    t_color = min(timeit.repeat(lambda: yc.by_color(start, end), number=1, repeat=repeat))
+    print('%i events, %i days' % (count, len(days)))
+    print('  get_events, linear scan: %8.2f ms' % (t_linear * 1000))
+    print('  get_events, date index:  %8.2f ms  (%.0fx)' % (t_indexed * 1000, t_linear / t_indexed))
+    print('  dates():                 %8.2f ms' % (t_dates * 1000))
+    print('  by_color():              %8.2f ms' % (t_color * 1000))
+
+if __name__ == '__main__':
+    main()
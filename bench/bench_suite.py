@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Benchmark suite for the hot paths of a calendar page, with JSON output.
+
+Synthetic gcal events (all-day, timed, multi-day and multi-month) are made
+at a few sizes, and these stages are timed for each size:
+
+    parse_date     parse the start and end of every event
+    yearcalendar   YearCalendar(...) construction
+    dates          list(YearCalendar.dates(...)), the month by month layout
+    by_color       YearCalendar.by_color(...)
+    render         the full calendar.html, through rendering.render_stream
+    fetch_and_render
+                   gcal.fetch_events() and calendarList().get() concurrently against
+                   fakegcal, then YearCalendar and render. Not the CalHandler path:
+                   no eventcache sync, pick_events or pagecache
+
+Run from the repository root, and keep the JSON to compare commits:
+
+    python bench/bench_suite.py [--sizes 100,2500,25000] [--repeat 5]
+                                [--latency 0.0] [--output results.json]
+
+"""
+import os, sys, datetime, timeit, json, platform, subprocess, argparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import gcal
+from yearcal import YearCalendar, parse_date
+from rendering import MONTHS, render_stream
+from fakegcal import FakeCalendarService, synthetic_events
+
+SIZES = (100, 2500, 25000)
+YEAR = 2016
+
+def render(yc, startdate, enddate, calendar_color=None):
+    "render calendar.html the way CalHandler does, and return the size of the page in bytes"
+    return sum(len(chunk) for chunk in render_stream('calendar.html', title=u'Bench', calendar=yc,
+                                                     months=MONTHS, calendar_color=calendar_color,
+                                                     colors_version='bench',
+                                                     startdate=startdate, enddate=enddate))
+
+def fetch_and_render(service, cal_id, startdate, enddate):
+    """fetch the range with gcal.fetch_events(), like CalHandler does for calendars too big to cache,
+    and the calendar color, then build YearCalendar and render it"""
+    lookups = gcal.Parallel(
+        lambda: gcal.fetch_events(service, cal_id,
+                                  datetime.datetime.combine(startdate, datetime.time()),
+                                  datetime.datetime.combine(enddate, datetime.time())),
+        lambda: service.calendarList().get(calendarId=cal_id, fields='colorId').execute().get('colorId'))
+    events, calendar_color = lookups.results()
+    yc = YearCalendar(cal_id, events)
+    return render(yc, startdate, enddate, calendar_color)
+
+def measure(func, repeat):
+    "time func() `repeat` times, return a dict of min and median, in milliseconds"
+    times = sorted(timeit.repeat(func, number=1, repeat=repeat))
+    return {'min_ms': round(times[0] * 1000, 3),
+            'median_ms': round(times[len(times) // 2] * 1000, 3)}
+
+def bench_size(count, repeat, latency):
+    events = synthetic_events(count, years=(YEAR,))
+    startdate, enddate = datetime.date(YEAR, 1, 1), datetime.date(YEAR+1, 1, 1)
+    yc = YearCalendar('bench', events)
+    service = FakeCalendarService({'bench': events}, latency=latency)
+
+    def parse_all():
+        for e in events:
+            parse_date(e['start'])
+            parse_date(e['end'])
+
+    results = {
+        'parse_date': measure(parse_all, repeat),
+        'yearcalendar': measure(lambda: YearCalendar('bench', events), repeat),
+        'dates': measure(lambda: list(yc.dates(startdate, enddate)), repeat),
+        'by_color': measure(lambda: yc.by_color(startdate, enddate), repeat),
+        'render': measure(lambda: render(yc, startdate, enddate), repeat),
+        'fetch_and_render': measure(lambda: fetch_and_render(service, 'bench', startdate, enddate), repeat),
+    }
+    results['page_bytes'] = render(yc, startdate, enddate)
+    results['segments'] = len(yc.events)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of a calendar page.')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES),
+                        help='comma separated numbers of events (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per stage, the min and median are kept')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per fake gcal request')
+    parser.add_argument('--output', help='write the JSON here instead of to stdout')
+    args = parser.parse_args()
+
+    report = {'revision': git_revision(),
+              'python': platform.python_version(),
+              'repeat': args.repeat,
+              'latency': args.latency,
+              'results': {}}
+    for count in [int(s) for s in args.sizes.split(',')]:
+        sys.stderr.write('%i events...\n' % count)
+        report['results'][str(count)] = bench_size(count, args.repeat, args.latency)
+
+    out = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        print(out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# encoding: utf-8
+"""A local stand-in for the parts of the Calendar v3 API that we use.
+
+FakeCalendarService(calendars) looks enough like
+apiclient.discovery.build('calendar', 'v3') for gcal.py and the calendar
+list: service.events().list(**params).execute(http=None) and
+service.calendarList().list() / .get(calendarId). Every execute() sleeps
+`latency` seconds, to behave like a round trip to Google.
+
+calendars is a dict of calendar id -> list of gcal event dicts, with
+'date' or UTC ('Z') 'dateTime' values in 'start' and 'end', like the ones
+synthetic_events() makes.
+
+"""
+import time, datetime, random
+
+# shares of timed (UTC), one day, multi-day and multi-month events, for synthetic_events()
+MIXED = (0.35, 0.40, 0.15, 0.10)
+ALL_DAY = (0.0, 0.60, 0.40, 0.0)
+TIMED = (1.0, 0.0, 0.0, 0.0)
+
+def synthetic_events(count, years=(2016,), mix=MIXED, seed=1):
+    """return `count` gcal event dicts for every year in years, in startTime order.
+    mix is the shares of timed, one day, multi-day and multi-month events, e.g. MIXED"""
+    rnd = random.Random(seed)
+    timed, oneday, multiday = mix[0], mix[0] + mix[1], mix[0] + mix[1] + mix[2]
+    events = []
+    for year in years:
+        jan1 = datetime.datetime(year, 1, 1)
+        for i in range(count):
+            start = jan1 + datetime.timedelta(days=rnd.randrange(365))
+            kind = rnd.random()
+            if kind < timed:
+                start += datetime.timedelta(hours=rnd.randrange(7, 20), minutes=rnd.choice((0, 15, 30, 45)))
+                end = start + datetime.timedelta(minutes=rnd.choice((30, 60, 90, 120)))
+                when = lambda dt: {'dateTime': '%sZ' % dt.isoformat()}
+            else:
+                if kind < oneday:
+                    days = 1
+                elif kind < multiday:
+                    days = rnd.randrange(2, 7)
+                else:
+                    days = rnd.randrange(20, 70)
+                end = start + datetime.timedelta(days=days)
+                when = lambda dt: {'date': dt.date().isoformat()}
+            event = {'id': 'ev%i_%06i' % (year, i),
+                     'iCalUID': 'ev%i_%06i@bench' % (year, i),
+                     'status': 'confirmed',
+                     'summary': u'Event nummer %i' % i,
+                     'start': when(start),
+                     'end': when(end)}
+            if rnd.random() < 0.5:
+                event['colorId'] = str(rnd.randrange(1, 12))
+            events.append(event)
+    events.sort(key=lambda e: _instant(e['start']))
+    return events
+
+def _instant(d):
+    "a sortable string for a gcal start/end dict"
+    if 'date' in d:
+        return '%sT00:00:00Z' % d['date']
+    return d['dateTime']
+
+class FakeRequest(object):
+    def __init__(self, func, latency):
+        self.func = func
+        self.latency = latency
+    def execute(self, http=None, num_retries=0):
+        time.sleep(self.latency)
+        return self.func()
+
+class FakeEvents(object):
+    def __init__(self, service):
+        self.service = service
+    def list(self, calendarId, timeMin=None, timeMax=None, pageToken=None,
+             maxResults=250, orderBy=None, **params):
+        def page():
+            self.service.requests += 1
+            items = self.service.calendars[calendarId]
+            if timeMin is not None:
+                # timeMin filters on end time, timeMax on start time
+                items = [e for e in items if _instant(e['end']) > timeMin]
+            if timeMax is not None:
+                items = [e for e in items if _instant(e['start']) < timeMax]
+            if orderBy == 'startTime':
+                items = sorted(items, key=lambda e: _instant(e['start']))
+            offset = int(pageToken or 0)
+            size = min(maxResults, 2500)
+            r = {'items': items[offset:offset+size]}
+            if offset + size < len(items):
+                r['nextPageToken'] = str(offset + size)
+            return r
+        return FakeRequest(page, self.service.latency)
+
+class FakeCalendarList(object):
+    def __init__(self, service):
+        self.service = service
+    def _entry(self, calendarId):
+        ids = sorted(self.service.calendars)
+        return {'id': calendarId,
+                'summary': u'Calendar %s' % calendarId,
+                'colorId': str(ids.index(calendarId) % 24 + 1),
+                'accessRole': 'owner'}
+    def list(self, **params):
+        def page():
+            self.service.requests += 1
+            return {'items': [self._entry(c) for c in sorted(self.service.calendars)]}
+        return FakeRequest(page, self.service.latency)
+    def get(self, calendarId, **params):
+        def entry():
+            self.service.requests += 1
+            return self._entry(calendarId)
+        return FakeRequest(entry, self.service.latency)
+
+class FakeCalendarService(object):
+    def __init__(self, calendars, latency=0.0):
+        self.calendars = calendars
+        self.latency = latency
+        self.requests = 0
+    def events(self):
+        return FakeEvents(self)
+    def calendarList(self):
+        return FakeCalendarList(self)
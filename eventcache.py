@@ -0,0 +1,275 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Per calendar event cache, kept in memcache and the datastore.
+
+The first time a calendar is asked for, all its events are fetched. After
+that, only the changes since the last sync are pulled from gcal, using the
+nextSyncToken of the previous sync.
+https://developers.google.com/google-apps/calendar/v3/sync
+
+The cache is kept per user, so nobody gets events from the cache of a
+calendar that gcal wouldn't have given them.
+
+A calendar with too many events for one datastore entity or memcache value
+(1 MB) is not cached. Its events are fetched for the requested range only,
+on every sync, like before there was a cache.
+
+"""
+
+# stdlib stuff
+import datetime, logging, heapq
+
+# appengine stuff
+from apiclient.errors import HttpError
+from google.appengine.api import memcache, datastore_errors
+from google.appengine.runtime import apiproxy_errors
+
+# our own stuff
+from models import CalendarEvents
+from yearcal import parse_date, timezone
+import gcal
+
+# the event fields we keep: what yearcal.Event uses, and status to drop cancelled events.
+# orderBy, timeMin and timeMax can't be used with syncToken, so we get everything and
+# sort and slice it ourselves
+FIELDS = ('items(colorId,end(date,dateTime),iCalUID,id,start(date,dateTime),status,summary),'
+          'nextPageToken,nextSyncToken,timeZone,updated')
+
+# don't ask gcal for changes more often than this
+SYNC_INTERVAL = datetime.timedelta(seconds=60)
+# don't try to cache a calendar that was too big again before this many seconds
+OVERSIZE_TIME = 24 * 60 * 60
+
+def _cache_id(owner, cal_id):
+    return '%s/%s' % (owner, cal_id)
+
+def _oversize_key(cache_id):
+    return 'oversize/%s' % cache_id
+
+def _sort_key(e, tz=None):
+    return (parse_date(e['start'], tz), e['start'].get('dateTime', ''))
+
+def _span(e, tz=None):
+    "[start, end) date ordinals of e in tz (a tzinfo), at least one day long, like yearcal.Event.days"
+    start = parse_date(e['start'], tz).toordinal()
+    return [start, max(start+1, parse_date(e['end'], tz).toordinal())]
+
+def _sort(items, time_zone):
+    "return items sorted by start in the time zone named time_zone, and their spans"
+    tz = timezone(time_zone)
+    items = sorted(items, key=lambda e: _sort_key(e, tz))
+    return items, [_span(e, tz) for e in items]
+
+def _sync(service, cal_id, http, sync_token=None):
+    """return (changed events, nextSyncToken, updated, timeZone) from a full sync,
+    or an incremental one if sync_token is given"""
+    params = dict(calendarId=cal_id, singleEvents=True, fields=FIELDS, maxResults=gcal.MAX_RESULTS)
+    if sync_token is not None:
+        params['syncToken'] = sync_token
+    items = []
+    for page in gcal.list_pages(service, http, **params):
+        items.extend(page.get('items', []))
+    # nextSyncToken and updated are only on the last page
+    return items, page.get('nextSyncToken'), page.get('updated'), page.get('timeZone')
+
+def _full_sync(service, cal_id, http, cache_id):
+    items, sync_token, updated, time_zone = _sync(service, cal_id, http)
+    items, spans = _sort([e for e in items if e.get('status') != 'cancelled'], time_zone)
+    return CalendarEvents(id=cache_id,
+                          cal_id=cal_id,
+                          events=items,
+                          spans=spans,
+                          sync_token=sync_token,
+                          updated=updated,
+                          time_zone=time_zone)
+
+def _incremental_sync(service, cal, http):
+    """apply the changes since the last sync to cal. Returns (cal, True if any events or the time zone changed),
+    or (None, True) if gcal wants a full sync"""
+    try:
+        changes, sync_token, updated, time_zone = _sync(service, cal.cal_id, http, cal.sync_token)
+    except HttpError as e:
+        if e.resp.status == 410:
+            # 410 Gone: the sync token is no longer valid
+            logging.info('sync token for %s has expired, doing a full sync', cal.cal_id)
+            return None, True
+        raise
+    # the dates of timed events move with the time zone of the calendar
+    changed = bool(changes) or (time_zone or cal.time_zone) != cal.time_zone
+    if changed:
+        events = dict((e['id'], e) for e in cal.events)
+        for e in changes:
+            if e.get('status') == 'cancelled':
+                events.pop(e['id'], None)
+            else:
+                events[e['id']] = e
+        cal.time_zone = time_zone or cal.time_zone
+        cal.events, cal.spans = _sort(events.values(), cal.time_zone)
+    cal.sync_token = sync_token
+    cal.updated = updated or cal.updated
+    return cal, changed
+
+def _fetch_range(service, cal_id, http, startdate, enddate, range_https=None, time_zone=None):
+    """return an unsaved CalendarEvents with the events of cal_id from startdate to enddate
+    (datetime.date), straight from gcal. For calendars that are too big to cache. time_zone is
+    the one the calendar had when it was last synced.
+
+    range_https is a list of authorized httplib2.Http, one per gcal.year_windows() window,
+    made in the request thread. With it, the windows are fetched concurrently with
+    gcal.fetch_events(), without it one after the other with http.
+
+    """
+    timeMin = datetime.datetime.combine(startdate, datetime.time())
+    timeMax = datetime.datetime.combine(enddate, datetime.time())
+    if range_https:
+        items = gcal.fetch_events(service, cal_id, timeMin, timeMax,
+                                  http_factory=iter(range_https).next, fields=FIELDS)
+    else:
+        items = gcal.list_all(service, http, calendarId=cal_id, singleEvents=True,
+                              maxResults=gcal.MAX_RESULTS, fields=FIELDS,
+                              timeMin=gcal.rfc3339(timeMin), timeMax=gcal.rfc3339(timeMax))
+    items, spans = _sort([e for e in items if e.get('status') != 'cancelled'], time_zone)
+    # a new version every SYNC_INTERVAL, so pages made from it are cached that long
+    now = datetime.datetime.utcnow()
+    updated = now - datetime.timedelta(seconds=now.second % SYNC_INTERVAL.seconds, microseconds=now.microsecond)
+    return CalendarEvents(cal_id=cal_id,
+                          events=items,
+                          spans=spans,
+                          updated='%sZ' % updated.isoformat(),
+                          time_zone=time_zone)
+
+def _store(cal, put=True):
+    "put cal in memcache, and in the datastore if put. Return False if it is too big for either"
+    try:
+        if put:
+            cal.put()
+        memcache.set(cal.key.id(), cal, namespace='events')
+    except (datastore_errors.BadRequestError, apiproxy_errors.RequestTooLargeError, ValueError) as e:
+        # memcache raises ValueError for values over 1 MB, the datastore BadRequestError for entities
+        logging.warning('events of %s are too big to cache: %r', cal.cal_id, e)
+        return False
+    return True
+
+def get_calendar(service, cal_id, owner, http=None, startdate=None, enddate=None, range_https=None):
+    """return the CalendarEvents of cal_id for the user id owner, synced with gcal if it wasn't just now.
+
+    If the calendar is too big to cache, only the events from startdate to enddate
+    (datetime.date) are fetched, and returned as an unsaved CalendarEvents. See
+    _fetch_range() for range_https.
+
+    """
+    cache_id = _cache_id(owner, cal_id)
+    synced_key, oversize_key = 'synced/%s' % cache_id, _oversize_key(cache_id)
+    cached = memcache.get_multi([cache_id, synced_key, oversize_key], namespace='events')
+    if oversize_key in cached:
+        time_zone = cached[oversize_key]
+        if not isinstance(time_zone, basestring): # flags from before they kept the time zone were True
+            time_zone = None
+        return _fetch_range(service, cal_id, http, startdate, enddate, range_https, time_zone or None)
+    cal = cached.get(cache_id)
+    in_memcache = cal is not None
+    if cal is None:
+        cal = CalendarEvents.get_by_id(cache_id)
+    # the time of the last sync is only kept in memcache, so syncs without changes don't write to the datastore
+    now = datetime.datetime.utcnow()
+    synced = cached.get(synced_key)
+    if cal is not None and synced is not None and now - synced < SYNC_INTERVAL:
+        if not in_memcache:
+            _store(cal, put=False)
+        return cal
+    changed, old_token = True, None
+    if cal is not None and cal.sync_token:
+        old_token = cal.sync_token
+        cal, changed = _incremental_sync(service, cal, http)
+    if cal is None:
+        cal = _full_sync(service, cal_id, http, cache_id)
+    # put only when the events changed. The sync token in the datastore may then be older than
+    # the one in memcache, which is fine: syncing from it just gets a few changes again
+    if changed:
+        stored = _store(cal)
+    elif cal.sync_token != old_token or not in_memcache:
+        stored = _store(cal, put=False)
+    else:
+        stored = True
+    if not stored:
+        # the flag keeps the time zone, the range fetches don't get it
+        memcache.set(oversize_key, cal.time_zone or u'', time=OVERSIZE_TIME, namespace='events')
+        cal.key.delete()
+        return _fetch_range(service, cal_id, http, startdate, enddate, range_https, cal.time_zone)
+    memcache.set(synced_key, now, namespace='events')
+    return cal
+
+def oversize_calendars(owner, cal_ids):
+    "return the set of the cal_ids that were too big to cache for the user id owner, in one memcache call"
+    keys = dict((_oversize_key(_cache_id(owner, cal_id)), cal_id) for cal_id in cal_ids)
+    return set(keys[k] for k in memcache.get_multi(keys.keys(), namespace='events'))
+
+def _between(cal, start, end):
+    "yield the indexes of the events in cal that overlap the date ordinals start -> end"
+    for (i, (s, e)) in enumerate(cal.spans):
+        if s >= end:
+            break # sorted by start, the rest start too late
+        if e > start:
+            yield i
+
+def events_between(cal, startdate, enddate):
+    "return the gcal event dicts in cal that overlap the range startdate -> enddate (datetime.date)"
+    return [cal.events[i] for i in _between(cal, startdate.toordinal(), enddate.toordinal())]
+
+def spans_in(cal, time_zone):
+    "return the [start, end) date ordinals of the events of cal in the time zone named time_zone, in the order of cal.events"
+    if time_zone == cal.time_zone:
+        return cal.spans
+    tz = timezone(time_zone)
+    return [_span(e, tz) for e in cal.events]
+
+def merge_events(cals, colors, startdate, enddate):
+    """Return the events of all cals that overlap the range startdate -> enddate, merged in start order.
+
+    The dates are in the time zone of the first cal. colors is a list with the calendar
+    colorId of every cal. Every event is a copy of the gcal dict, with '_calendarId' and
+    '_calendarColorId' added.
+
+    """
+    start, end = startdate.toordinal(), enddate.toordinal()
+    time_zone = cals[0].time_zone
+    def keyed(n, cal):
+        if cal.time_zone == time_zone:
+            # already sorted like _sort_key, so a k-way merge keeps the order
+            spans, indexes = cal.spans, _between(cal, start, end)
+        else:
+            # timed events may move to another day, and all-day events don't, so sort again
+            spans = spans_in(cal, time_zone)
+            indexes = sorted((i for (i, (s, e)) in enumerate(spans) if s < end and e > start),
+                             key=lambda i: (spans[i][0], cal.events[i]['start'].get('dateTime', '')))
+        for i in indexes:
+            e = cal.events[i]
+            yield (spans[i][0], e['start'].get('dateTime', ''), n, i, e)
+    merged = []
+    for (s, t, n, i, e) in heapq.merge(*[keyed(n, cal) for (n, cal) in enumerate(cals)]):
+        e = dict(e)
+        e['_calendarId'] = cals[n].cal_id
+        e['_calendarColorId'] = colors[n]
+        merged.append(e)
+    return merged
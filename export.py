@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Export year calendars to static HTML and ICS files, many at a time.
+
+Every calendar id and range is rendered with YearCalendar and
+templates/calendar.html, just like /cal/<id>/<range>, and the events are
+written to an .ics file next to it:
+
+    <out>/<calendar id>/<range>.html
+    <out>/<calendar id>/<range>.ics
+
+The events come from JSON dumps (--dumps DIR, with one <calendar id>.json
+per calendar, holding the response of events().list() or just a list of
+events) or from the Calendar API (--credentials FILE, an oauth2client
+credentials file). The exports run in a pool of worker processes, one
+calendar and range per task, and both files are written while they are
+rendered, so a worker only holds one calendar at a time.
+
+    python export.py --dumps dumps/ --range 2017 --out planners/ <calendar id> [<calendar id> ...]
+
+The pages link /static/style.css and /colors.css, so serve <out> as the web
+root. static/ is copied there, and colors.css is made from --colors FILE
+(the response of colors().get()) or from the Calendar API.
+
+"""
+
+# stdlib stuff
+import os, sys, json, datetime, argparse, shutil, urllib, logging, multiprocessing, hashlib
+
+# third party stuff
+# install howto in appengine_requirements.txt
+import dateutil.parser, dateutil.relativedelta, dateutil.tz
+
+# our own stuff
+from yearcal import YearCalendar, parse_date, timezone
+from rendering import MONTHS, render_stream, render_response
+import gcal
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+def parse_range(s):
+    "parse '2017' or '2017_01-2017_12' (like the /cal/<id>/<range> urls) to (startdate, enddate), enddate exclusive"
+    if '-' not in s:
+        year = int(s)
+        return (datetime.date(year, 1, 1), datetime.date(year+1, 1, 1))
+    start, end = s.split('-')
+    startdate = datetime.datetime.strptime(start, '%Y_%m').date()
+    enddate = datetime.datetime.strptime(end, '%Y_%m').date() + dateutil.relativedelta.relativedelta(months=1)
+    if enddate <= startdate:
+        raise ValueError('range %r ends before it starts' % s)
+    return (startdate, enddate)
+
+def range_name(startdate, enddate):
+    "the file name of a range, like the urls: 2017_01-2017_12"
+    return '%s-%s' % (startdate.strftime('%Y_%m'), (enddate - datetime.timedelta(days=1)).strftime('%Y_%m'))
+
+def quote(cal_id):
+    "make a calendar id usable as a file name"
+    return urllib.quote(cal_id, safe='@.')
+
+# the service and credentials of this worker process, see get_service()
+_service = {}
+
+def get_service(credentials_file):
+    "return (service, http_factory) for the Calendar API, made once per process"
+    if credentials_file not in _service:
+        # only needed when talking to google, so not imported at the top
+        import httplib2
+        from apiclient.discovery import build_from_document
+        from oauth2client.file import Storage
+        credentials = Storage(credentials_file).get()
+        if credentials is None or credentials.invalid:
+            raise RuntimeError('no valid credentials in %s' % credentials_file)
+        with open(os.path.join(ROOT, 'discovery', 'calendar-v3.json')) as f:
+            service = build_from_document(f.read())
+        # httplib2 is not thread safe, so every thread of gcal.fetch_events gets its own Http
+        _service[credentials_file] = (service, lambda: credentials.authorize(httplib2.Http()))
+    return _service[credentials_file]
+
+def span(e, tz=None):
+    "(start, end) datetime.date of e in tz (a tzinfo), at least one day long, like eventcache._span"
+    start = parse_date(e['start'], tz)
+    return (start, max(start + datetime.timedelta(days=1), parse_date(e['end'], tz)))
+
+def load_events(job):
+    """return (title, calendar colorId, tzinfo, [gcal event dicts]) of the calendar and range of job.
+    tzinfo is the time zone of the calendar, or None if the dump doesn't say"""
+    cal_id, startdate, enddate = job['cal_id'], job['startdate'], job['enddate']
+    if job['dumps'] is not None:
+        with open(os.path.join(job['dumps'], '%s.json' % quote(cal_id))) as f:
+            dump = json.load(f)
+        if isinstance(dump, dict):
+            title, items, tz = dump.get('summary', cal_id), dump.get('items', []), timezone(dump.get('timeZone'))
+        else:
+            title, items, tz = cal_id, dump, None
+        items = [e for e in items if e.get('status') != 'cancelled']
+        items = [e for (e, (start, end)) in zip(items, [span(e, tz) for e in items])
+                 if start < enddate and end > startdate]
+        items.sort(key=lambda e: e['start'].get('date') or e['start'].get('dateTime'))
+        return (title, None, tz, items)
+    service, http_factory = get_service(job['credentials'])
+    from apiclient.errors import HttpError # like in get_service(), only needed when talking to google
+    def get_entry(http):
+        try:
+            return service.calendarList().get(calendarId=cal_id, fields='summary,colorId,timeZone').execute(http=http)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+        # readable, but not in the calendar list of the user (e.g. a public calendar), so no color,
+        # like main.get_calendar_color()
+        return service.calendars().get(calendarId=cal_id, fields='summary,timeZone').execute(http=http)
+    lookups = gcal.Parallel(
+        lambda http=http_factory(): get_entry(http),
+        lambda: gcal.fetch_events(service, cal_id,
+                                  datetime.datetime.combine(startdate, datetime.time()),
+                                  datetime.datetime.combine(enddate, datetime.time()),
+                                  http_factory=http_factory))
+    entry, items = lookups.results()
+    return (entry.get('summary', cal_id), entry.get('colorId'), timezone(entry.get('timeZone')), items)
+
+def ics_escape(s):
+    "escape a TEXT value, RFC 5545 3.3.11"
+    return s.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def ics_fold(line):
+    "fold a content line in pieces of at most 75 octets, RFC 5545 3.1"
+    line = line.encode('utf-8')
+    pieces = []
+    while len(line) > 75:
+        cut = 75 if not pieces else 74 # continuation lines start with a space
+        while cut > 0 and (ord(line[cut]) & 0xC0) == 0x80: # don't split a utf-8 sequence
+            cut -= 1
+        pieces.append(line[:cut])
+        line = line[cut:]
+    pieces.append(line)
+    return '\r\n '.join(pieces) + '\r\n'
+
+def ics_when(d):
+    "format a gcal start or end dict as an ics property suffix, e.g. ';VALUE=DATE:20170101' or ':20170101T120000Z'"
+    if 'date' in d:
+        return ';VALUE=DATE:%s' % d['date'].replace('-', '')
+    dt = dateutil.parser.parse(d['dateTime'])
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(dateutil.tz.tzutc())
+    return ':%s' % dt.strftime('%Y%m%dT%H%M%SZ')
+
+def ics_lines(cal_id, title, items, stamp):
+    "yield the folded lines of an ics calendar with the gcal event dicts items"
+    yield 'BEGIN:VCALENDAR\r\n'
+    yield 'VERSION:2.0\r\n'
+    yield 'PRODID:-//perpetual-yearcal//export//EN\r\n'
+    yield ics_fold(u'X-WR-CALNAME:%s' % ics_escape(title))
+    for e in items:
+        # the events are singleEvents, and all instances of a recurring event share its iCalUID,
+        # so they get one UID each, like the non-recurring events without an iCalUID
+        if e.get('iCalUID') and not e.get('recurringEventId'):
+            uid = e['iCalUID']
+        else:
+            uid = '%s@%s' % (e.get('id'), cal_id)
+        yield 'BEGIN:VEVENT\r\n'
+        yield ics_fold(u'UID:%s' % uid)
+        yield 'DTSTAMP:%s\r\n' % stamp
+        yield 'DTSTART%s\r\n' % ics_when(e['start'])
+        yield 'DTEND%s\r\n' % ics_when(e['end'])
+        yield ics_fold(u'SUMMARY:%s' % ics_escape(e.get('summary', u'')))
+        yield 'END:VEVENT\r\n'
+    yield 'END:VCALENDAR\r\n'
+
+def export(job):
+    """export one calendar and range. Runs in a worker process.
+
+    Returns (cal_id, range name, number of events, None), or (cal_id, range name, None, error message)
+    if it failed, so one bad calendar doesn't stop the others.
+
+    """
+    try:
+        return _export(job) + (None,)
+    except Exception as e:
+        return (job['cal_id'], range_name(job['startdate'], job['enddate']), None, '%s: %s' % (e.__class__.__name__, e))
+
+def _export(job):
+    "export one calendar and range, see export(). Returns (cal_id, range name, number of events)"
+    cal_id, startdate, enddate = job['cal_id'], job['startdate'], job['enddate']
+    title, calendar_color, tz, items = load_events(job)
+    folder = os.path.join(job['out'], quote(cal_id))
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError: # another worker made it
+            pass
+    name = range_name(startdate, enddate)
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    with open(os.path.join(folder, '%s.ics' % name), 'wb') as f:
+        for line in ics_lines(cal_id, title, items, stamp):
+            f.write(line)
+    yc = YearCalendar(cal_id, items, tz=tz)
+    with open(os.path.join(folder, '%s.html' % name), 'wb') as f:
+        for chunk in render_stream('calendar.html', title=title, calendar=yc, months=MONTHS,
+                                   calendar_color=calendar_color, colors_version=job['colors_version'],
+                                   startdate=startdate, enddate=enddate, static=True):
+            f.write(chunk)
+    return (cal_id, name, len(items))
+
+class ColorEntry(object):
+    "what templates/colors.css wants from a models.Color"
+    def __init__(self, category, colorId, background=None, foreground=None, **kwargs):
+        self.category = category
+        self.colorId = colorId
+        self.background = background
+        self.foreground = foreground
+
+def write_static(out, colors_file, credentials_file):
+    "copy static/ to out, and write out/colors.css. Returns the version of colors.css for the pages"
+    target = os.path.join(out, 'static')
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    shutil.copytree(os.path.join(ROOT, 'static'), target)
+    if colors_file is not None:
+        with open(colors_file) as f:
+            colors = json.load(f)
+    elif credentials_file is not None:
+        service, http_factory = get_service(credentials_file)
+        colors = service.colors().get().execute(http=http_factory())
+    else:
+        colors = {}
+    entries = [ColorEntry(z, colId, **col)
+               for z in ('calendar', 'event')
+               for colId, col in sorted(colors.get(z, {}).items())]
+    css = render_response('colors.css', colors=entries).encode('utf-8')
+    with open(os.path.join(out, 'colors.css'), 'wb') as f:
+        f.write(css)
+    return hashlib.sha1(css).hexdigest()
+
+def main():
+    nextyear = str(datetime.date.today().year + 1)
+    parser = argparse.ArgumentParser(description='Export year calendars to static HTML and ICS files.')
+    parser.add_argument('cal_ids', nargs='*', metavar='CALENDAR_ID', help='calendars to export')
+    parser.add_argument('--list', help='file with more calendar ids, one per line')
+    parser.add_argument('--range', action='append', dest='ranges', metavar='RANGE',
+                        help='2017 or 2017_01-2017_12, may be repeated (default: %s)' % nextyear)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dumps', help='directory of <calendar id>.json event dumps')
+    source.add_argument('--credentials', help='oauth2client credentials file, to fetch from the Calendar API')
+    parser.add_argument('--colors', help='JSON from colors().get(), for colors.css')
+    parser.add_argument('--out', default='export', help='output directory (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='worker processes (default: one per core, %(default)s)')
+    parser.add_argument('--maxtasksperchild', type=int, default=20,
+                        help='restart a worker after this many exports, to keep its memory flat (default: %(default)s)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    cal_ids = list(args.cal_ids)
+    if args.list:
+        with open(args.list) as f:
+            cal_ids.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    if not cal_ids:
+        parser.error('no calendar ids')
+    try:
+        ranges = [parse_range(r) for r in (args.ranges or [nextyear])]
+    except ValueError as e:
+        parser.error('--range: %s' % e)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    colors_version = write_static(args.out, args.colors, args.credentials)
+    jobs = [dict(cal_id=cal_id, startdate=startdate, enddate=enddate,
+                 dumps=args.dumps, credentials=args.credentials, out=args.out,
+                 colors_version=colors_version)
+            for cal_id in cal_ids
+            for (startdate, enddate) in ranges]
+
+    if args.processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(args.processes, maxtasksperchild=args.maxtasksperchild)
+        results = pool.imap_unordered(export, jobs, chunksize=1)
+    else:
+        pool = None
+        results = (export(job) for job in jobs)
+    failed = 0
+    try:
+        for (n, (cal_id, name, count, error)) in enumerate(results, 1):
+            if error is not None:
+                failed += 1
+                sys.stderr.write('[%i/%i] %s %s: failed, %s\n' % (n, len(jobs), cal_id, name, error))
+            else:
+                sys.stderr.write('[%i/%i] %s %s: %i events\n' % (n, len(jobs), cal_id, name, count))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if failed:
+        sys.stderr.write('%i of %i exports failed\n' % (failed, len(jobs)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
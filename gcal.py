@@ -0,0 +1,164 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Fetching events from the Calendar v3 API.
+
+Everything here talks to `service`, which only needs to look like what
+apiclient.discovery.build('calendar', 'v3') returns:
+service.events().list(**params).execute(http=http) -> dict. That makes it
+easy to run against a local stand-in of the API.
+
+"""
+
+# stdlib stuff
+import datetime, logging, threading, Queue, sys
+
+# https://developers.google.com/google-apps/calendar/v3/reference/events/list
+#   maxResults: The page size can never be larger than 2500 events.
+MAX_RESULTS = 2500
+
+# threads per Parallel call
+MAX_THREADS = 8
+
+class Parallel(object):
+    """Run the functions on a pool of at most MAX_THREADS threads. Call results() to wait for them.
+
+    The calling thread is free to do other work in the meantime. The pool only
+    lives as long as there is work in it: App Engine joins every thread of a
+    request when the request ends, so threads kept for the next request would
+    keep this one from ever finishing.
+
+    """
+    def __init__(self, *funcs):
+        self._results = [None] * len(funcs)
+        self._errors = [None] * len(funcs)
+        self._queue = Queue.Queue()
+        for job in enumerate(funcs):
+            self._queue.put(job)
+        self._threads = [threading.Thread(target=self._work) for n in range(min(len(funcs), MAX_THREADS))]
+        for t in self._threads:
+            t.start()
+
+    def _work(self):
+        "run functions from the queue until it is empty"
+        while True:
+            try:
+                i, f = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._results[i] = f()
+            except Exception:
+                # results() re-raises it, and the caller decides whether to log it
+                self._errors[i] = sys.exc_info()
+
+    def results(self):
+        """Wait for all functions and return their results, in order.
+
+        If any of them raised, the first exception (in argument order) is re-raised here,
+        with its traceback.
+
+        """
+        for t in self._threads:
+            t.join()
+        for exc_info in self._errors:
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+        return self._results
+
+def parallel(*funcs):
+    "Call the functions on a thread pool and return their results, in order. See Parallel"
+    if len(funcs) == 1:
+        return [funcs[0](),]
+    return Parallel(*funcs).results()
+
+def rfc3339(dt):
+    "format a naive (UTC) datetime.datetime the way timeMin and timeMax want it"
+    return '%sZ' % dt.isoformat()
+
+def year_windows(timeMin, timeMax):
+    "split the datetime.datetime range timeMin -> timeMax into a list of (start, end) tuples, one per calendar year"
+    windows = []
+    start = timeMin
+    while start < timeMax:
+        end = min(timeMax, datetime.datetime(start.year+1, 1, 1))
+        windows.append( (start, end) )
+        start = end
+    return windows
+
+def list_pages(service, http=None, **params):
+    "yield every result page of events().list(**params), following nextPageToken until the last page"
+    while True:
+        page = service.events().list(**params).execute(http=http)
+        yield page
+        token = page.get('nextPageToken')
+        if token is None:
+            return
+        params['pageToken'] = token
+
+def list_all(service, http=None, **params):
+    "return all event dicts from events().list(**params), from every result page"
+    items = []
+    for page in list_pages(service, http, **params):
+        items.extend(page.get('items', []))
+    return items
+
+def fetch_events(service, cal_id, timeMin, timeMax, http_factory=None, **params):
+    """Return all events of cal_id from timeMin to timeMax (datetime.datetime), in startTime order.
+
+    The range is split into one window per calendar year, and the windows are
+    fetched concurrently, every one of them following its result pages to the end.
+
+    http_factory is called once per window, in the calling thread, to get an
+    authorized httplib2.Http for it. httplib2 is not thread safe, and the
+    oauth2client decorator keeps its credentials in a thread local, so the
+    Http objects can't be made in the worker threads.
+
+    """
+    params.setdefault('singleEvents', True)
+    params.setdefault('orderBy', 'startTime')
+    params.setdefault('maxResults', MAX_RESULTS)
+    windows = year_windows(timeMin, timeMax)
+    def window_fetcher(start, end, http):
+        return lambda: list_all(service, http,
+                                calendarId=cal_id,
+                                timeMin=rfc3339(start),
+                                timeMax=rfc3339(end),
+                                **params)
+    pages = parallel(*[window_fetcher(start, end, http_factory() if http_factory else None)
+                       for (start, end) in windows])
+    # the windows are consecutive and each one is sorted, so they are already in
+    # startTime order when chained. An event that crosses new year is returned
+    # by both windows (timeMin filters on end time); keep the first one.
+    seen = set()
+    items = []
+    for page in pages:
+        for e in page:
+            key = e.get('id')
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            items.append(e)
+    logging.debug('fetch_events: %i events from %i windows', len(items), len(windows))
+    return items
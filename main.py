@@ -23,31 +23,30 @@
 # SOFTWARE.
 
 # stdlib stuff
-import os.path, logging, httplib2, datetime, calendar
-import collections, copy, json
+import os.path, logging, httplib2, datetime, json, time, hashlib, urllib, cProfile, pstats, marshal, zlib, StringIO
 
 # third party stuff
 # install howto in appengine_requirements.txt
 import dateutil.parser, dateutil.relativedelta
-import requests
-from requests_oauthlib import OAuth1Session
-from trello import TrelloClient, Unauthorized, ResourceUnavailable
+# the Trello / OAuth1 stack (requests, requests_oauthlib, trello) is imported on
+# first use, see trellocache.load_trello(), so cold starts don't pay for it
 
 # appengine stuff
-import webapp2, jinja2
-from apiclient.discovery import build
+import webapp2
+from apiclient.discovery import build_from_document
+from apiclient.errors import HttpError
 from google.appengine.api import memcache, users
+from google.appengine.ext import ndb
 from oauth2client.appengine import OAuth2DecoratorFromClientSecrets
 from oauth2client.client import AccessTokenRefreshError
 from webapp2_extras import sessions
 	
 # our own stuff
-from models import Color, CalendarPrettyTitle, UserSetup
-
-JINJA_ENVIRONMENT = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)),
-    extensions=['jinja2.ext.autoescape'],
-    autoescape=True)
+from models import Color, CalendarPrettyTitle, UserSetup, StyleSheet
+from yearcal import YearCalendar, Event, busy_stats, color_class, timezone
+from rendering import MONTHS, render_response, render_stream, render_macro
+import eventcache, pagecache, gcal, timing, trellocache
+from trellocache import load_trello
 
 # Restrict access to users that have granted access to Calendar information.
 decorator = OAuth2DecoratorFromClientSecrets(
@@ -61,152 +60,143 @@ except:
     trello_secrets = None
 
 http = httplib2.Http(memcache)
-service = build('calendar', 'v3', http=http)
-
-# by default, requests_oauthlib doesnt work on appengine because no socket support
-# use requests_toolbelt and the apppengineadapter to get around this
-#https://toolbelt.readthedocs.io/en/latest/adapters.html#appengineadapter
-from requests_toolbelt.adapters import appengine
-appengine.monkeypatch()
-
-def render_response(template, **context):
-    template = JINJA_ENVIRONMENT.get_template(os.path.join('templates', template))
-    return template.render(**context)
-
-def parse_date(d):
-    """Parse {u'date': u'2014-10-10'} or {u'dateTime': u'2014-10-10T12:30:00+02:00'} and return datetime"""
-    if d.has_key('date'):
-        return dateutil.parser.parse(d['date'], fuzzy=True).date()
-    elif d.has_key('dateTime'):
-        return dateutil.parser.parse(d['dateTime'], fuzzy=True).date()
-    else:
-        return None
-
-def monthmod(dt, delta):
-    logging.info("monthmod: %r %r", dt, delta)
-    one_month = dateutil.relativedelta.relativedelta(months=1)
-    new = dt + (delta*one_month)
-    return new
-JINJA_ENVIRONMENT.filters['monthmod'] = monthmod
-
-def yearmonth(dt):
-    'filter to format a datetime to "%Y_%m"'
-    return dt.strftime('%Y_%m')
-JINJA_ENVIRONMENT.filters['yearmonth'] = yearmonth
-
-class Date(object):
-    def __init__(self, date, events):
-        self.date = date #datetime.datetime
-        self.month = date.month
-        self.year, self.weeknumber, self.weekday = date.isocalendar() # Return a 3-tuple, (ISO year, ISO week number, ISO weekday).
-        self.events = events # list
-        self.yearmonth = self.date.strftime('%Y-%m')
-
-
-class Event(object):
-    "High level access to the dict returned from gcal"
-    def __init__(self, gcaldict): # parse a dict from gcal
-        #logging.info('Event from %s', gcaldict)
-        self.startdate = parse_date(gcaldict['start']) # get datetime.datetime
-        self.enddate = parse_date(gcaldict['end']) # get datetime.datetime
-        self.days = max(1, (self.enddate-self.startdate).days) # integer, at least 1
-        self.items = gcaldict
-        self.colorId = gcaldict.get('colorId', None)
-        self.slug = self.slugify(gcaldict['summary'], self.days)
-    def slugify(self, s, span):
-        'Shorten a string according to available span'
-        SLUGLENGTH=int(30*span)
-        if len(s) < SLUGLENGTH:
-            return s
-        return u'%s..' % s[:SLUGLENGTH]
-    def multiple_days(self):
-        return self.days > 1
-    def multiple_months(self):
-        return self.startdate.month != self.enddate.month and self.enddate.day > 1
-
-class YearCalendar(calendar.Calendar):
-    "Super Class of calendar.Calendar to display a year with events"
-    def __init__(self, cal_id, events, firstweekday=None):
-        super(YearCalendar, self).__init__(firstweekday=firstweekday or 0) # 0 == Monday
-        self.id = cal_id
-        # logging.info('eents:%s', events)
-        _e = []
-        for e in events:
-            E = Event(e)
-            _e.append( (E.startdate, E) )
-            if E.multiple_months():
-                # we need to clone this event and display it next month, too
-                # TODO: handle many monhts, not just next
-                _new_startdate = E.enddate.replace(day=1) # start cloned event at first of enddate month
-                _new_E = copy.deepcopy(E)
-                _new_E.days = max(1, (_new_E.enddate-_new_startdate).days)
-                _e.append( (_new_startdate, _new_E) )
-        self.events = _e
-
-    def iterdates(self, startdate=None, enddate=None):
-        """iterate over all dates from startdate to enddate, defaulting to 1jan-31dec of current year.
-
-        startdate and enddate can be None, datetime.date or dict instance from gcal
-
-        """
-        logging.info('iterdates: start %s - > end %s', startdate, enddate)
-        _thisyear = datetime.datetime.now()
-        if startdate is None:
-            startdate = datetime.date(_thisyear, 1, 1)
-        elif isinstance(startdate, dict):
-            startdate = parse_date(startdate)
-        if enddate is None:
-            enddate = datetime.date(_thisyear, 12, 31)
-        elif isinstance(enddate, dict):
-            enddate = parse_date(enddate)
-
-        h24 = datetime.timedelta(days=1)
-
-        curdate = startdate
-        while curdate < enddate:
-            yield Date(curdate, self.get_events(curdate))
-            curdate = curdate + h24
-
-    def dates(self, startdate=None, enddate=None):
-        "return all dates as a dict"
-        _all = collections.OrderedDict({})
-        for d in self.iterdates(startdate, enddate):
-            # d is Date object
-            try:
-                _all[d.yearmonth].append(d)
-            except KeyError:
-                _all[d.yearmonth] = [d,]
-        return _all
-
-    def get_events(self, date):
-        "return a list of all events for a specific datetime.date"
-        evts = []
-        for ev in self.events:
-            # (datetime.date, data)
-            if ev[0] == date:
-                evts.append(ev[1])
-        return evts
-
-    def by_color(self, startdate=None, enddate=None):
-        "return a dict of all events keyed by color"
-        _r = {}
-        for (evdate, e) in self.events:
-            if startdate < evdate < enddate:
-                try:
-                    _r[e.colorId].append(e)
-                except KeyError:
-                    _r[e.colorId] = [e,]
-        return _r
+# build the service from a bundled copy of the discovery document, instead of fetching it at every cold start.
+# to update: curl https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest > discovery/calendar-v3.json
+with open(os.path.join(os.path.dirname(__file__), 'discovery', 'calendar-v3.json')) as f:
+    service = build_from_document(f.read(), http=http)
+
+def get_calendar_color(cal_id, owner, http):
+    "return the colorId the user owner has given cal_id in their calendar list, or None. Cached for an hour"
+    key = '%s/%s' % (owner, cal_id)
+    color = memcache.get(key, namespace='calendarcolors')
+    if color is None:
+        try:
+            color = service.calendarList().get(calendarId=cal_id, fields='colorId').execute(http=http).get('colorId', u'')
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            color = u'' # not in the calendar list of the user
+        memcache.set(key, color, time=3600, namespace='calendarcolors')
+    return color or None
+
+def build_colors_css(colors=None):
+    "compile colors.css from colors (default: all Color entities), store it and return the StyleSheet"
+    if colors is None:
+        colors = Color.query()
+    css = render_response('colors.css', colors=colors).encode('utf-8')
+    S = StyleSheet(id='colors.css', css=css, etag=hashlib.sha1(css).hexdigest())
+    S.put()
+    memcache.set('colors.css', (S.etag, S.css), namespace='css')
+    return S
+
+def get_colors_css():
+    "return (etag, css) of the compiled colors.css. The etag is a hash of the css, and doubles as its version"
+    compiled = memcache.get('colors.css', namespace='css')
+    if compiled is None:
+        S = StyleSheet.get_by_id('colors.css') or build_colors_css()
+        compiled = (S.etag, S.css)
+        memcache.set('colors.css', compiled, namespace='css')
+    return compiled
+
+def parse_range(startmonth=None, endmonth=None):
+    """parse the '2016_01' and '-2016_12' parts of a calendar url to (startdate, enddate), defaulting to this year.
+    Raises ValueError if the range ends before it starts"""
+    # get keywords or default values
+    _thisyear = datetime.datetime.now().year
+    try:
+        startdate = datetime.datetime.strptime(startmonth, '%Y_%m').date()
+    except (TypeError, ValueError):
+        startdate = datetime.date(_thisyear, 1, 1)
+    try:
+        _end = datetime.datetime.strptime(endmonth, '-%Y_%m').date()
+        enddate = _end + dateutil.relativedelta.relativedelta(months=1) # stop at first of next month
+    except (ValueError, TypeError):
+        enddate = datetime.date(startdate.year+1, 1, 1)
+    if enddate <= startdate:
+        raise ValueError('%s ends before %s' % (endmonth, startmonth))
+    return startdate, enddate
+
+def get_cal_ids(cal_id, request):
+    "return the calendar ids to show: cal_id from the url, and the ones to merge with it from ?with=<id>&with=<id>..."
+    cal_ids = [cal_id]
+    for c in request.get_all('with'):
+        if c and c not in cal_ids: # every calendar once, in the order of the url
+            cal_ids.append(c)
+    return cal_ids
+
+def merge_query(cal_ids):
+    "the query string that merges cal_ids[1:] into the first calendar, for links"
+    if len(cal_ids) == 1:
+        return ''
+    return '?%s' % urllib.urlencode([('with', c.encode('utf-8')) for c in cal_ids[1:]])
+
+def start_lookups(cal_ids, owner, startdate, enddate, timer=None):
+    """Start syncing the event caches and looking up the calendar colors of cal_ids for the user owner.
+
+    startdate and enddate are the range that is shown, for calendars too big to cache, see eventcache.py.
+
+    The lookups run on a thread pool. Returns a gcal.Parallel, see lookup_results()
+
+    """
+    timer = timer or timing.Timer()
+    # calendars too big to cache are fetched one window per year, concurrently, see
+    # gcal.fetch_events(). The Http objects have to be made here, in the request thread,
+    # and only for the calendars that are known to be too big
+    oversize = eventcache.oversize_calendars(owner, cal_ids)
+    if oversize:
+        windows = len(gcal.year_windows(datetime.datetime.combine(startdate, datetime.time()),
+                                        datetime.datetime.combine(enddate, datetime.time())))
+    funcs = []
+    for (n, cal_id) in enumerate(cal_ids):
+        suffix = '' if len(cal_ids) == 1 else '-%i' % n
+        range_https = [decorator.http() for w in range(windows)] if cal_id in oversize else None
+        # all events of a calendar are cached and kept in sync with gcal, see eventcache.py.
+        funcs.append(timer.timed('events' + suffix,
+            lambda cal_id=cal_id, http=decorator.http(), range_https=range_https:
+                eventcache.get_calendar(service, cal_id, owner, http, startdate, enddate, range_https)))
+        funcs.append(timer.timed('color' + suffix,
+            lambda cal_id=cal_id, http=decorator.http(): get_calendar_color(cal_id, owner, http)))
+    return gcal.Parallel(*funcs)
+
+def lookup_results(lookups):
+    "wait for start_lookups() and return ([CalendarEvents, ...], [calendar colorId, ...])"
+    results = lookups.results()
+    return results[0::2], results[1::2]
+
+def pick_events(cals, calendar_colors, startdate, enddate):
+    "return the events of cals from startdate to enddate in start order, merging them if there are several"
+    if len(cals) == 1:
+        return eventcache.events_between(cals[0], startdate, enddate)
+    return eventcache.merge_events(cals, calendar_colors, startdate, enddate)
+
+def save_profile(profiler):
+    "store the stats of a cProfile.Profile in memcache for an hour, and return the url to get them from"
+    profiler.create_stats()
+    key = hashlib.sha1(os.urandom(16)).hexdigest()[:16]
+    memcache.set(key, zlib.compress(marshal.dumps(profiler.stats)), time=3600, namespace='profiles')
+    return '/_stats/profile/%s' % key
 
 class BaseHandler(webapp2.RequestHandler):
     def dispatch(self):
         # Get a session store for this request.
         self.session_store = sessions.get_store(request=self.request)
-
+        # time the stages of every request, see timing.py. Handlers add their own stages to self.timer
+        self.timer = timing.Timer()
+        # admins can add ?profile=1 to get a cProfile dump of the request, see StatsProfileHandler
+        profiler = None
+        if self.request.get('profile') == '1' and users.is_current_user_admin():
+            profiler = cProfile.Profile()
+            profiler.enable()
         try:
             # Dispatch the request.
             webapp2.RequestHandler.dispatch(self)
         finally:
+            if profiler is not None:
+                profiler.disable()
+                self.response.headers['X-Profile'] = save_profile(profiler)
+            self.response.headers['Server-Timing'] = self.timer.server_timing()
+            timing.stats.add_timer(self.__class__.__name__, self.timer)
+            logging.debug('%s %s: %s', self.__class__.__name__, self.request.path, self.timer.summary())
             # Save all sessions.
             self.session_store.save_sessions(self.response)
 
@@ -215,115 +205,235 @@ class BaseHandler(webapp2.RequestHandler):
         # Returns a session using the default cookie key.
         return self.session_store.get_session()
 
+    def write_auth_view(self):
+        "write the front page with a link to authorize access to the calendars"
+        url = decorator.authorize_url()
+        self.response.write(render_response('index.html', calendars=[], authorize_url=url))
+
+    def serve_lookups(self, lookups, page_key, build, auth_view=False):
+        """Wait for start_lookups(), and write the page made from its results.
+
+        page_key(cals, calendar_colors) returns the pagecache key of the page, which is also its ETag.
+        build(cals, calendar_colors) makes the page, as a byte string.
+        It is only called when the client doesn't have the page already and it isn't in pagecache.
+
+        Answers 404 for calendars that don't exist. When the credentials can't be refreshed,
+        writes the authorization view if auth_view, else answers 401.
+
+        """
+        try:
+            cals, calendar_colors = lookup_results(lookups)
+        except HttpError as e:
+            if e.resp.status == 404:
+                self.abort(404) # no such calendar
+            raise
+        except AccessTokenRefreshError:
+            # the access token has expired and cannot be refreshed (e.g. manual token revoking)
+            if not auth_view:
+                self.abort(401)
+            self.write_auth_view()
+            return
+        # the page only changes with the events (cal.updated), so build it once per version
+        key = page_key(cals, calendar_colors)
+        self.response.headers['Cache-Control'] = 'private, no-cache'
+        self.response.etag = key
+        updated = [cal.updated for cal in cals if cal.updated is not None]
+        if updated:
+            self.response.last_modified = max(dateutil.parser.parse(u) for u in updated)
+        if key in self.request.if_none_match:
+            self.response.status = 304
+            return
+        with self.timer.stage('pagecache'):
+            page = pagecache.get(key)
+        if page is None:
+            page = build(cals, calendar_colors)
+            pagecache.set(key, page)
+        self.response.write(page)
+
 class CalListHandler(BaseHandler):
     @decorator.oauth_aware
     def get(self):
-        logging.info('callisthandler has credentials: %r', decorator.has_credentials())
-        def write_auth_view():
-            url = decorator.authorize_url()
-            self.response.write(render_response('index.html', calendars=[], authorize_url=url))
-
+        logging.debug('callisthandler has credentials: %r', decorator.has_credentials())
         if decorator.has_credentials():
+            currentuser = users.get_current_user()
+            U = UserSetup.get_by_id(currentuser.email())
+            def get_boards():
+                if U is None or not U.trello_token:
+                    return []
+                try:
+                    return trellocache.get_boards(trello_secrets, U)
+                except Exception as e:
+                    # trello being slow or down shouldn't take the calendar list with it
+                    logging.exception(e)
+                    return []
+            # ask google and trello at the same time
+            lookups = gcal.Parallel(
+                self.timer.timed('calendarlist',
+                    lambda http=decorator.http(): service.calendarList().list().execute(http=http)),
+                self.timer.timed('trello', get_boards))
             try:
-                cal_list = service.calendarList().list().execute(http=decorator.http())
+                cal_list, boards = lookups.results()
             except AccessTokenRefreshError:
                 # credentials have expired, neeed new auth
-                write_auth_view()
+                self.write_auth_view()
                 return
-            for c in cal_list['items']:
-                # do we have a pretty title? Store it.
-                #logging.info(c)
-                try:
-                    CPT = CalendarPrettyTitle.get_by_id(c['id'])
-                    if CPT is None:
-                        CPT = CalendarPrettyTitle(cal_id = c['id'],
-                                                  id = c['id'])
-                    if c.has_key('summaryOverride'):
-                        CPT.pretty_title = c['summaryOverride']
-                    elif not c['summary'].startswith('http'): # dont store urls
-                        CPT.pretty_title = c['summary']
-                    CPT.put()
-                except Exception as e:
-                    logging.exception(e)
-            boards = []
-            currentuser = users.get_current_user()
-            U = UserSetup.get_by_id(currentuser.email())
-            if U is not None and U.trello_token:
-                logging.info('trelloboardlist token :%r', U.trello_token)
-                trello_client = TrelloClient(
-                    api_key=trello_secrets.get('trello_key'),
-                    api_secret=trello_secrets.get('trello_secret'),
-                    token=U.trello_token.get('oauth_token'),
-                    token_secret=U.trello_token.get('oauth_token_secret')
-                )
-                boards = trello_client.list_boards(board_filter="open")
-                
+            # do we have pretty titles? Store them, in one batch, and only those that changed
+            try:
+                CalendarPrettyTitle.update_titles(cal_list['items'])
+            except Exception as e:
+                logging.exception(e)
             self.response.write(render_response('index.html', 
                                 calendars=cal_list['items'],
                                 trelloboards=boards,
             ))
         else:
-            write_auth_view()
+            self.write_auth_view()
 
 class CalHandler(BaseHandler):
     @decorator.oauth_aware
     def get(self, cal_id, startmonth=None, endmonth=None, **kwargs):
         #logging.info("got args: %s %s %s %s", cal_id, startmonth, endmonth, kwargs)
         if decorator.has_credentials():
-            # get keywords or default values
-            _thisyear = datetime.datetime.now().year
-            try:
-                startdate = datetime.datetime.strptime(startmonth, '%Y_%m').date()
-            except (TypeError, ValueError):
-                startdate = datetime.date(_thisyear, 1, 1)
-            try:
-                _end = datetime.datetime.strptime(endmonth, '-%Y_%m').date()
-                enddate = _end.replace(month=_end.month+1) # stop at first of next month
-            except (ValueError, TypeError):
-                if startdate is not None:
-                    enddate = datetime.date(startdate.year, 12, 31)
-                else:
-                    enddate = datetime.date(_thisyear, 12, 31)
-            fields = kwargs.get('fields', 'description,items(colorId,creator,description,end,iCalUID,id,location,start,status,summary),nextPageToken,summary')
-            # only list events from startdate to enddate, using timeMin & timeMax
-            # https://developers.google.com/google-apps/calendar/v3/reference/events/list
-            #   timeMin: string, Lower bound (inclusive) for an event's end time to filter by. Optional. The default is not to filter by end time. Must be an RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00, 2011-06-03T10:00:00Z. Milliseconds may be provided but will be ignored.
-            #   timeMax: string, Upper bound (exclusive) for an event's start time to filter by. Optional. The default is not to filter by start time. Must be an RFC3339 timestamp with mandatory time zone offset, e.g., 2011-06-03T10:00:00-07:00, 2011-06-03T10:00:00Z. Milliseconds may be provided but will be ignored.
-            # add 'maxResults=2500' to make sure we get as much as we can
-            #   maxResults: integer, Maximum number of events returned on one result page. By default the value is 250 events. The page size can never be larger than 2500 events. Optional.
-            timeMin_dt = datetime.datetime.combine(startdate, datetime.datetime.min.time())
-            timeMax_dt = datetime.datetime.combine(enddate, datetime.datetime.min.time()) + datetime.timedelta(days=1)
             try:
-                cal_events = service.events().list(calendarId=cal_id,
-                                                   singleEvents=True,
-                                                   fields=fields,
-                                                   timeMin='%sZ' % timeMin_dt.isoformat(),
-                                                   timeMax='%sZ' % timeMax_dt.isoformat(),
-                                                   maxResults=2500,
-                                                   orderBy='startTime').execute(http=decorator.http())
-            except AccessTokenRefreshError:
-                # In cases where the access token has expired and cannot be refreshed
-                # (e.g. manual token revoking) redirect the user to the authorization page
-                # to authorize.
-                url = decorator.authorize_url()
-                self.response.write(render_response('index.html', calendars=[], authorize_url=url))
-
-            # TODO: use list_next(previous_request=*, previous_response=*) if there are more results pages
-            #logging.info(cal_events)
-            # try to get pretty title from db
-            try:
-                pretty_title = CalendarPrettyTitle.get_by_id(cal_id).pretty_title
-            except AttributeError:
-                # no pretty title recorded
-                pretty_title = cal_id
-            yc = YearCalendar(cal_id, cal_events['items'])
-            months = ['Null', 'Januar', 'Februar', 'Mars', 'April', 'Mai', 'Juni', 'Juli',
-                      'August', 'September', 'Oktober', 'November', 'Desember']
-            self.response.write(render_response('calendar.html', title=pretty_title, calendar=yc, months=months,
-                                                startdate=startdate, enddate=enddate))
+                startdate, enddate = parse_range(startmonth, endmonth)
+            except ValueError:
+                self.abort(400)
+            owner = users.get_current_user().user_id()
+            # several calendars can be shown together, as /cal/<id1>?with=<id2>&with=<id3>...
+            cal_ids = get_cal_ids(cal_id, self.request)
+            # look up titles, calendar colors and events at the same time: the titles with
+            # ndb async in this thread, gcal on a thread pool
+            timer = self.timer
+            title_started = time.time()
+            title_futures = [CalendarPrettyTitle.get_title_async(c) for c in cal_ids] # try to get pretty titles from cache or db
+            lookups = start_lookups(cal_ids, owner, startdate, enddate, timer)
+            pretty_title = u' + '.join((f.get_result() or c) for (f, c) in zip(title_futures, cal_ids))
+            timer.record('title', title_started)
+            colors_version = get_colors_css()[0]
+
+            def page_key(cals, calendar_colors):
+                return pagecache.cache_key(owner, cal_ids, startdate, enddate,
+                                           [(cal.updated, cal.time_zone) for cal in cals], calendar_colors,
+                                           pretty_title, colors_version)
+
+            def build(cals, calendar_colors):
+                calendar_color = calendar_colors[0] if len(cal_ids) == 1 else None
+                with timer.stage('pick'):
+                    # pick the events from startdate to enddate from the cached sets
+                    cal_events = pick_events(cals, calendar_colors, startdate, enddate)
+                with timer.stage('parse'):
+                    events = Event.from_items(cal_events, timezone(cals[0].time_zone))
+                with timer.stage('yearcalendar'):
+                    yc = YearCalendar(cal_id, events)
+                with timer.stage('render'):
+                    # the python27 runtime buffers the whole response anyway, so render it here to
+                    # get it in Server-Timing. yc.dates() is a generator, with one month of Date objects at a time
+                    return ''.join(render_stream('calendar.html', title=pretty_title, calendar=yc, months=MONTHS,
+                                                 calendar_color=calendar_color, colors_version=colors_version,
+                                                 startdate=startdate, enddate=enddate, query=merge_query(cal_ids)))
+
+            self.serve_lookups(lookups, page_key, build, auth_view=True)
         else:
-            url = decorator.authorize_url()
-            self.response.write(render_response('index.html', calendars=[], authorize_url=url))
+            self.write_auth_view()
+
+class EventHandler(BaseHandler):
+    "The whole of one event, as JSON. The calendar only keeps what it shows, see yearcal.Event"
+    @decorator.oauth_aware
+    def get(self, cal_id, event_id):
+        if not decorator.has_credentials():
+            self.abort(401)
+        try:
+            with self.timer.stage('event'):
+                event = service.events().get(calendarId=cal_id, eventId=event_id).execute(http=decorator.http())
+        except AccessTokenRefreshError:
+            self.abort(401)
+        except HttpError as e:
+            self.abort(e.resp.status)
+        self.response.content_type = 'application/json'
+        self.response.headers['Cache-Control'] = 'private, max-age=60'
+        self.response.write(json.dumps(event))
+
+class MonthHandler(BaseHandler):
+    "One month of a calendar, as JSON with the rendered month row and the events of the month"
+    @decorator.oauth_aware
+    def get(self, cal_id, month):
+        if not decorator.has_credentials():
+            self.abort(401)
+        try:
+            startdate = datetime.datetime.strptime(month, '%Y_%m').date()
+        except ValueError: # e.g. 2016_13, the route only checks the digits
+            self.abort(404)
+        enddate = startdate + dateutil.relativedelta.relativedelta(months=1)
+        owner = users.get_current_user().user_id()
+        cal_ids = get_cal_ids(cal_id, self.request)
+        lookups = start_lookups(cal_ids, owner, startdate, enddate, self.timer)
+
+        def fragment_key(cals, calendar_colors):
+            # every month is cached on its own, so growing the range costs one month of work
+            return pagecache.cache_key('month', owner, cal_ids, month,
+                                       [(cal.updated, cal.time_zone) for cal in cals], calendar_colors)
+
+        def build(cals, calendar_colors):
+            with self.timer.stage('pick'):
+                cal_events = pick_events(cals, calendar_colors, startdate, enddate)
+            with self.timer.stage('parse'):
+                events = Event.from_items(cal_events, timezone(cals[0].time_zone))
+            with self.timer.stage('yearcalendar'):
+                yc = YearCalendar(cal_id, events)
+            with self.timer.stage('render'):
+                yearmonth, days = next(yc.dates(startdate, enddate))
+                html = render_macro('month.html', 'month_row', yc, MONTHS, yearmonth, days)
+            return json.dumps({'yearmonth': month,
+                               'html': html,
+                               'events': cal_events})
+
+        self.response.content_type = 'application/json'
+        self.serve_lookups(lookups, fragment_key, build)
+
+class BusyHandler(BaseHandler):
+    """How busy every day and ISO week of a calendar is, and the events per color, see yearcal.busy_stats().
+    JSON, or a heatmap with ?format=html"""
+    @decorator.oauth_aware
+    def get(self, cal_id, startmonth=None, endmonth=None):
+        html = self.request.get('format') == 'html'
+        if not decorator.has_credentials():
+            if html:
+                self.write_auth_view()
+                return
+            self.abort(401)
+        try:
+            startdate, enddate = parse_range(startmonth, endmonth)
+        except ValueError:
+            self.abort(400)
+        owner = users.get_current_user().user_id()
+        cal_ids = get_cal_ids(cal_id, self.request)
+        lookups = start_lookups(cal_ids, owner, startdate, enddate, self.timer)
+        colors_version = get_colors_css()[0]
+
+        def stats_key(cals, calendar_colors):
+            return pagecache.cache_key('busy', owner, cal_ids, startdate, enddate, html,
+                                       [(cal.updated, cal.time_zone) for cal in cals], calendar_colors, colors_version)
+
+        def build(cals, calendar_colors):
+            with self.timer.stage('busy'):
+                # straight from the cached [start, end) day ordinals of the events, no Event objects needed
+                starts, ends, classes = [], [], []
+                for (cal, calendar_color) in zip(cals, calendar_colors):
+                    if len(cals) == 1:
+                        calendar_color = None # like CalHandler, only merged events get their calendar color
+                    spans = eventcache.spans_in(cal, cals[0].time_zone) # the dates of the first calendar
+                    starts.extend(s for (s, e) in spans)
+                    ends.extend(e for (s, e) in spans)
+                    classes.extend(color_class(e.get('colorId'), calendar_color) for e in cal.events)
+                stats = busy_stats(starts, ends, classes, startdate, enddate)
+            if not html:
+                return json.dumps(stats)
+            with self.timer.stage('render'):
+                return render_response('busy.html', calendar_id=u' + '.join(cal_ids), stats=stats, offset=startdate.weekday(),
+                                       colors_version=colors_version).encode('utf-8')
+
+        self.response.content_type = 'text/html' if html else 'application/json'
+        self.serve_lookups(lookups, stats_key, build, auth_view=html)
 
 class GetColorsHandler(BaseHandler):
     @decorator.oauth_aware
@@ -331,15 +441,16 @@ class GetColorsHandler(BaseHandler):
         if decorator.has_credentials():
             colors = service.colors().get().execute(http=decorator.http())
             logging.info(colors)
-            for z in ('calendar', 'event'):
-                for colId, col in colors[z].items():
-                    mycol = Color.get_or_insert('%s#%s' % (z, colId), colorId=colId,
-                                                                      category=z,
-                                                                      **col)
+            # upsert all colors in one batch
+            mycolors = [Color(id='%s#%s' % (z, colId), colorId=colId, category=z, **col)
+                        for z in ('calendar', 'event')
+                        for colId, col in colors[z].items()]
+            ndb.put_multi(mycolors)
+            # compile colors.css from what we just stored, a query might not see it yet
+            build_colors_css(mycolors)
             return webapp2.redirect('/colors')
         else:
-            url = decorator.authorize_url()
-            self.response.write(render_response('index.html', calendars=[], authorize_url=url))
+            self.write_auth_view()
 
 class ColorsHandler(webapp2.RequestHandler):
     def get(self):
@@ -347,8 +458,18 @@ class ColorsHandler(webapp2.RequestHandler):
 
 class ColorsCSSHandler(webapp2.RequestHandler):
     def get(self):
+        etag, css = get_colors_css()
         self.response.content_type = 'text/css'
-        self.response.write(render_response('colors.css', colors=Color.query()))
+        self.response.etag = etag
+        if self.request.get('v') == etag:
+            # versioned url, from a page that knows the current version. it will never change
+            self.response.headers['Cache-Control'] = 'public, max-age=31536000'
+        else:
+            self.response.headers['Cache-Control'] = 'public, max-age=3600'
+        if etag in self.request.if_none_match:
+            self.response.status = 304
+            return
+        self.response.write(css)
 
 class TrelloConnectHandler(BaseHandler):
     def get(self):
@@ -363,6 +484,7 @@ class TrelloConnectHandler(BaseHandler):
         trello_secret = trello_secrets.get('trello_secret')
         name = 'Perpetual Yearcal'
         
+        TrelloClient, OAuth1Session = load_trello()
         session = OAuth1Session(client_key=trello_key, client_secret=trello_secret)
         response = session.fetch_request_token(request_token_url)
         resource_owner_key, resource_owner_secret = response.get('oauth_token'), response.get('oauth_token_secret')
@@ -402,6 +524,7 @@ class TrelloConnectedHandler(BaseHandler):
         access_token_url = 'https://trello.com/1/OAuthGetAccessToken'
         trello_key = trello_secrets.get('trello_key')
         trello_secret = trello_secrets.get('trello_secret')
+        TrelloClient, OAuth1Session = load_trello()
         session = OAuth1Session(client_key=trello_key, 
                                 client_secret=trello_secret,
                                 resource_owner_key=resource_owner_key, 
@@ -423,16 +546,53 @@ class TrelloBoardHandler(BaseHandler):
         currentuser = users.get_current_user()
         U = UserSetup.get_by_id(currentuser.email())
         if U is not None and U.trello_token:
-            logging.info('trelloboard token :%r', U.trello_token)
-            trello_client = TrelloClient(
-                api_key=trello_secrets.get('trello_key'),
-                api_secret=trello_secrets.get('trello_secret'),
-                token=U.trello_token.get('oauth_token'),
-                token_secret=U.trello_token.get('oauth_token_secret')
-            )
-            board = trello_client.get_board(board_id)
-            self.response.write(vars(board))
-                          
+            board = trellocache.get_board(trello_secrets, U, board_id)
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps(board))
+
+class StatsHandler(webapp2.RequestHandler):
+    "The request stage timings of this instance, as JSON. For admins, see app.yaml"
+    def get(self):
+        if not users.is_current_user_admin():
+            self.abort(403)
+        self.response.content_type = 'application/json'
+        self.response.headers['Cache-Control'] = 'no-cache'
+        self.response.write(json.dumps({'instance': os.environ.get('INSTANCE_ID'),
+                                        'version': os.environ.get('CURRENT_VERSION_ID'),
+                                        'since': datetime.datetime.utcfromtimestamp(timing.stats.since).isoformat(),
+                                        'stats': timing.stats.report()},
+                                       indent=2, sort_keys=True))
+
+    def post(self):
+        "start over"
+        if not users.is_current_user_admin():
+            self.abort(403)
+        timing.stats.reset()
+        self.redirect('/_stats')
+
+class StatsProfileHandler(webapp2.RequestHandler):
+    """A cProfile dump saved by a ?profile=1 request, as text, or with ?format=raw
+    as a file for pstats.Stats(), snakeviz etc. For admins, see app.yaml"""
+    def get(self, key):
+        if not users.is_current_user_admin():
+            self.abort(403)
+        dump = memcache.get(key, namespace='profiles')
+        if dump is None:
+            self.abort(404)
+        dump = zlib.decompress(dump)
+        if self.request.get('format') == 'raw':
+            self.response.content_type = 'application/octet-stream'
+            self.response.headers['Content-Disposition'] = 'attachment; filename="%s.pstats"' % key
+            self.response.write(dump)
+            return
+        class Dump(object):
+            "what pstats.Stats() wants, instead of a file name"
+            def create_stats(self):
+                self.stats = marshal.loads(dump)
+        out = StringIO.StringIO()
+        pstats.Stats(Dump(), stream=out).sort_stats('cumulative').print_stats(80)
+        self.response.content_type = 'text/plain'
+        self.response.write(out.getvalue())
 
 class MainHandler(BaseHandler):
     def get(self):
@@ -443,6 +603,10 @@ class MainHandler(BaseHandler):
 app = webapp2.WSGIApplication([
     ('/', MainHandler),
     ('/cals', CalListHandler),
+    (r'/cal/([^/]+)/month/(\d{4}_\d{2})', MonthHandler),
+    (r'/cal/([^/]+)/event/([^/]+)', EventHandler),
+    (r'/cal/([^/]+)/busy/(\d{4}_\d{2})(-\d{4}_\d{2})?', BusyHandler),
+    (r'/cal/([^/]+)/busy', BusyHandler),
     (r'/cal/([^/]+)/(\d{4}_\d{2})(-\d{4}_\d{2})?', CalHandler),
     (r'/cal/([^/]+)', CalHandler),
     ('/getcolors', GetColorsHandler),
@@ -452,6 +616,8 @@ app = webapp2.WSGIApplication([
     ('/trelloconnected', TrelloConnectedHandler),
     #('/boards', TrelloBoardListHandler),
     (r'/board/([^/]+)', TrelloBoardHandler),
+    ('/_stats', StatsHandler),
+    (r'/_stats/profile/([0-9a-f]+)', StatsProfileHandler),
     (decorator.callback_path, decorator.callback_handler()),
 
 ], debug=False, 
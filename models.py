@@ -22,6 +22,7 @@
 # SOFTWARE.
 
 # appengine stuff
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
 class Color(ndb.Model):
@@ -31,13 +32,66 @@ class Color(ndb.Model):
   category = ndb.StringProperty() # 'calendar' or 'event'
   title = ndb.StringProperty()
 
+class StyleSheet(ndb.Model):
+  "A compiled stylesheet, e.g. colors.css"
+  css = ndb.BlobProperty() # utf-8
+  etag = ndb.StringProperty(indexed=False) # sha1 of css
+  timestamp = ndb.DateTimeProperty(auto_now=True)
+
 class CalendarPrettyTitle(ndb.Model):
   cal_id = ndb.StringProperty()
   pretty_title = ndb.StringProperty()
 
+  @classmethod
+  @ndb.tasklet
+  def get_title_async(cls, cal_id):
+    "return a Future for the pretty title of cal_id, from memcache if we can, or None"
+    ctx = ndb.get_context()
+    title = yield ctx.memcache_get(cal_id, namespace='titles')
+    if title is None:
+      CPT = yield cls.get_by_id_async(cal_id)
+      title = (CPT and CPT.pretty_title) or u''
+      yield ctx.memcache_set(cal_id, title, namespace='titles')
+    raise ndb.Return(title or None)
+
+  @classmethod
+  def update_titles(cls, calendars):
+    """Store the pretty titles of calendars, a list of dicts from gcal calendarList().list().
+
+    Reads all of them in one batch, and writes back only the ones that changed.
+
+    """
+    stored = ndb.get_multi([ndb.Key(cls, c['id']) for c in calendars])
+    changed = []
+    for c, CPT in zip(calendars, stored):
+      if c.has_key('summaryOverride'):
+        title = c['summaryOverride']
+      elif not c['summary'].startswith('http'): # dont store urls
+        title = c['summary']
+      else:
+        title = None
+      if CPT is None:
+        CPT = cls(cal_id=c['id'], id=c['id'], pretty_title=title)
+      elif title is None or CPT.pretty_title == title:
+        continue # nothing new
+      CPT.pretty_title = title
+      changed.append(CPT)
+    if changed:
+      ndb.put_multi(changed)
+      memcache.set_multi(dict((CPT.cal_id, CPT.pretty_title or u'') for CPT in changed), namespace='titles')
+    return changed
+
 class UserSetup(ndb.Model):
   user = ndb.UserProperty()
   google_token = ndb.JsonProperty()
   trello_token = ndb.JsonProperty() # oauth1 access token dict, where .keys() == ('oauth_token', 'oauth_token_secret')
   timestamp = ndb.DateTimeProperty(auto_now=True)
-  
\ No newline at end of file
+  
+class CalendarEvents(ndb.Model):
+  "All events of one calendar, kept up to date with Calendar API sync tokens. See eventcache.py"
+  cal_id = ndb.StringProperty()
+  events = ndb.JsonProperty(compressed=True) # list of gcal event dicts, sorted by start
+  spans = ndb.JsonProperty(compressed=True) # list of [start, end) date ordinals, one per event
+  sync_token = ndb.StringProperty(indexed=False) # nextSyncToken from the last sync
+  updated = ndb.StringProperty(indexed=False) # last modification time of the calendar, RFC3339
+  time_zone = ndb.StringProperty(indexed=False) # timeZone of the calendar, e.g. u'Europe/Oslo'. The spans are in it
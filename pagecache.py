@@ -0,0 +1,90 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Cache of rendered pages.
+
+Pages are kept in memcache, which is shared by all instances, and in a
+byte size limited LRU cache in this instance, which is looked at first.
+The cache key doubles as the ETag of the page.
+
+"""
+
+# stdlib stuff
+import os, collections, hashlib, threading
+
+# appengine stuff
+from google.appengine.api import memcache
+
+# make a new deploy start with a clean cache, in case the templates changed
+VERSION = os.environ.get('CURRENT_VERSION_ID', '')
+
+class LRUCache(object):
+    "Thread safe least recently used cache of byte strings, holding at most max_bytes"
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return None
+            self._items[key] = value # most recently used is last
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                (_, evicted) = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+local = LRUCache(max_bytes=16*1024*1024)
+
+def cache_key(*parts):
+    "return a key (and ETag) for a page made from parts"
+    return hashlib.sha1(repr((VERSION,) + parts)).hexdigest()
+
+def get(key):
+    "return the cached page (a byte string) for key, or None"
+    page = local.get(key)
+    if page is None:
+        page = memcache.get(key, namespace='pages')
+        if page is not None:
+            local.set(key, page)
+    return page
+
+def set(key, page):
+    "cache the page (a byte string) under key. Pages too big for memcache are only cached in this instance"
+    local.set(key, page)
+    if len(page) <= memcache.MAX_VALUE_SIZE:
+        memcache.set(key, page, namespace='pages')
@@ -0,0 +1,101 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Jinja environment and helpers for rendering the templates/ directory."""
+
+# stdlib stuff
+import os.path, logging, datetime
+
+# third party stuff
+# install howto in appengine_requirements.txt
+import dateutil.relativedelta
+import jinja2
+
+# appengine stuff
+try:
+    from google.appengine.api import memcache
+except ImportError: # export.py and bench/ run outside App Engine
+    memcache = None
+
+JINJA_ENVIRONMENT = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)),
+    extensions=['jinja2.ext.autoescape'],
+    autoescape=True)
+
+class MemcacheBytecodeCache(jinja2.BytecodeCache):
+    "Keep compiled templates in memcache, so new instances don't have to compile them again"
+    def load_bytecode(self, bucket):
+        code = memcache.get(bucket.key, namespace='jinja2')
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        memcache.set(bucket.key, bucket.bytecode_to_string(), namespace='jinja2')
+
+# the bucket key is a hash of the template name and file name only, so it stays the same when a
+# template changes. jinja keeps a checksum of the source in the stored bytecode, and compiles
+# the template again when it doesn't match
+if memcache is not None:
+    JINJA_ENVIRONMENT.bytecode_cache = MemcacheBytecodeCache()
+
+# month names, MONTHS[1] is january
+MONTHS = ['Null', 'Januar', 'Februar', 'Mars', 'April', 'Mai', 'Juni', 'Juli',
+          'August', 'September', 'Oktober', 'November', 'Desember']
+
+def render_response(template, **context):
+    template = JINJA_ENVIRONMENT.get_template(os.path.join('templates', template))
+    return template.render(**context)
+
+def render_macro(template, macro, *args, **kwargs):
+    "call a macro from a template, e.g. render_macro('month.html', 'month_row', ...)"
+    template = JINJA_ENVIRONMENT.get_template(os.path.join('templates', template))
+    return getattr(template.module, macro)(*args, **kwargs)
+
+def render_stream(template, buffer_size=64, **context):
+    """Render template piece by piece, and yield the output as utf-8 encoded byte strings.
+
+    buffer_size is the number of template pieces to join per chunk.
+
+    """
+    template = JINJA_ENVIRONMENT.get_template(os.path.join('templates', template))
+    stream = template.stream(**context)
+    stream.enable_buffering(buffer_size)
+    for chunk in stream:
+        yield chunk.encode('utf-8')
+
+def monthmod(dt, delta):
+    logging.debug("monthmod: %r %r", dt, delta)
+    one_month = dateutil.relativedelta.relativedelta(months=1)
+    new = dt + (delta*one_month)
+    return new
+JINJA_ENVIRONMENT.filters['monthmod'] = monthmod
+
+def daymod(dt, delta):
+    'filter to add delta days to a datetime'
+    return dt + datetime.timedelta(days=delta)
+JINJA_ENVIRONMENT.filters['daymod'] = daymod
+
+def yearmonth(dt):
+    'filter to format a datetime to "%Y_%m"'
+    return dt.strftime('%Y_%m')
+JINJA_ENVIRONMENT.filters['yearmonth'] = yearmonth
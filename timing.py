@@ -0,0 +1,132 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Timing of the stages of a request, and statistics over many requests."""
+
+# stdlib stuff
+import time, contextlib, threading, collections, re
+
+class Timer(object):
+    """Records when the named stages of a request start and how long they take.
+
+    Stages may run at the same time, in other threads.
+
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.stages = [] # (name, start, duration) tuples, in seconds since self.started
+
+    def record(self, name, start, end=None):
+        "record stage name from start to end (time.time() values), end defaulting to now"
+        if end is None:
+            end = time.time()
+        self.stages.append( (name, start - self.started, end - start) ) # list.append is thread safe
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        "time the with block as stage name"
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def timed(self, name, func):
+        "return a function that calls func as stage name"
+        def _timed(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return _timed
+
+    def summary(self):
+        "return a line like 'events 0+310ms, title 1+12ms, total 330ms'"
+        parts = ['%s %i+%ims' % (name, start * 1000, duration * 1000)
+                 for (name, start, duration) in sorted(self.stages, key=lambda s: s[1])]
+        parts.append('total %ims' % ((time.time() - self.started) * 1000))
+        return ', '.join(parts)
+
+    def server_timing(self):
+        "return the stages as a Server-Timing header value, like 'events;dur=310.2, title;dur=12.0, total;dur=330.5'"
+        parts = ['%s;dur=%.1f' % (_token(name), duration * 1000)
+                 for (name, start, duration) in sorted(self.stages, key=lambda s: s[1])]
+        parts.append('total;dur=%.1f' % ((time.time() - self.started) * 1000))
+        return ', '.join(parts)
+
+def _token(name):
+    "make name usable as a Server-Timing metric name"
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+class Stats(object):
+    """Durations of the stages of many requests, per group (e.g. handler name) and stage.
+
+    Keeps count, total and max of every stage, and the last `recent`
+    durations for percentiles. Thread safe. The numbers are per instance.
+
+    """
+    def __init__(self, recent=200):
+        self.recent = recent
+        self.since = time.time()
+        self._lock = threading.Lock()
+        self._stages = {} # (group, name) -> [count, total, max, deque of recent durations]
+
+    def add(self, group, name, duration):
+        "add one duration (in seconds) of stage name in group"
+        with self._lock:
+            try:
+                s = self._stages[(group, name)]
+            except KeyError:
+                s = self._stages[(group, name)] = [0, 0.0, 0.0, collections.deque(maxlen=self.recent)]
+            s[0] += 1
+            s[1] += duration
+            s[2] = max(s[2], duration)
+            s[3].append(duration)
+
+    def add_timer(self, group, timer):
+        "add every stage of timer, and its total until now"
+        for (name, start, duration) in list(timer.stages):
+            self.add(group, name, duration)
+        self.add(group, 'total', time.time() - timer.started)
+
+    def report(self):
+        """return {group: {stage: {count, mean_ms, max_ms, p50_ms, p95_ms}}}.
+        The percentiles are over the recent durations only."""
+        with self._lock:
+            stages = [(k, v[0], v[1], v[2], sorted(v[3])) for (k, v) in self._stages.items()]
+        report = {}
+        for ((group, name), count, total, longest, recent) in stages:
+            report.setdefault(group, {})[name] = {
+                'count': count,
+                'mean_ms': round(total / count * 1000, 1),
+                'max_ms': round(longest * 1000, 1),
+                'p50_ms': round(recent[len(recent) // 2] * 1000, 1),
+                'p95_ms': round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 1),
+            }
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self.since = time.time()
+
+# the stats of this instance
+stats = Stats()
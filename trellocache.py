@@ -0,0 +1,145 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""Trello clients and a cache of Trello boards.
+
+One TrelloClient per user is kept in this instance, each with its own
+requests.Session, so connections are reused between requests.
+
+Board lists and board metadata are cached in memcache. Fresh entries are
+served as is. Stale entries are still served, while a task refreshes them
+in the background (stale-while-revalidate). Only missing entries make the
+user wait for Trello.
+
+"""
+
+# stdlib stuff
+import time, threading
+
+# appengine stuff
+from google.appengine.api import memcache
+from google.appengine.ext import deferred
+
+# our own stuff
+from models import UserSetup
+
+FRESH = 5 * 60 # seconds a cached entry is used as is
+STALE = 24 * 60 * 60 # seconds a stale entry is used while it is refreshed
+MAX_CLIENTS = 100 # TrelloClients to keep in this instance
+
+_lock = threading.Lock()
+_loaded = []
+_clients = {} # oauth_token -> TrelloClient
+
+def load_trello():
+    """Import the Trello / OAuth1 stack, and patch requests to work on appengine. Only the first call does any work.
+
+    Returns (TrelloClient, OAuth1Session)
+
+    """
+    with _lock:
+        if not _loaded:
+            # by default, requests_oauthlib doesnt work on appengine because no socket support
+            # use requests_toolbelt and the apppengineadapter to get around this
+            #https://toolbelt.readthedocs.io/en/latest/adapters.html#appengineadapter
+            from requests_toolbelt.adapters import appengine
+            appengine.monkeypatch()
+            from requests_oauthlib import OAuth1Session
+            from trello import TrelloClient
+            _loaded.extend([TrelloClient, OAuth1Session])
+    return tuple(_loaded)
+
+def get_client(secrets, token):
+    "return the TrelloClient of the oauth1 access token dict token, made with the app secrets, and reused"
+    TrelloClient, OAuth1Session = load_trello()
+    import requests
+    with _lock:
+        client = _clients.get(token.get('oauth_token'))
+        if client is None:
+            if len(_clients) >= MAX_CLIENTS:
+                _clients.clear()
+            client = TrelloClient(
+                api_key=secrets.get('trello_key'),
+                api_secret=secrets.get('trello_secret'),
+                token=token.get('oauth_token'),
+                token_secret=token.get('oauth_token_secret'),
+                http_service=requests.Session() # keeps connections open between calls
+            )
+            _clients[token.get('oauth_token')] = client
+        return client
+
+def board_dict(board):
+    "the parts of a trello Board we show, as a dict that can go in memcache"
+    return dict(id=board.id,
+                name=board.name,
+                description=getattr(board, 'description', None),
+                closed=getattr(board, 'closed', None),
+                url=getattr(board, 'url', None))
+
+def _fetch_boards(secrets, token):
+    return [board_dict(b) for b in get_client(secrets, token).list_boards(board_filter="open")]
+
+def _fetch_board(secrets, token, board_id):
+    return board_dict(get_client(secrets, token).get_board(board_id))
+
+def _cached(key, fetch, refresh):
+    "return the value under key in memcache, calling fetch() if it is missing and refresh() if it is stale"
+    now = time.time()
+    cached = memcache.get(key, namespace='trello')
+    if cached is not None:
+        (fetched, value) = cached
+        if now - fetched > FRESH and memcache.add('refreshing:%s' % key, 1, time=60, namespace='trello'):
+            # stale: serve it anyway, and have one task refresh it
+            refresh()
+        return value
+    value = fetch()
+    memcache.set(key, (now, value), time=FRESH + STALE, namespace='trello')
+    return value
+
+def refresh(email, board_id=None):
+    "deferred task to fetch the boards (or one board) of the user with email, and cache them"
+    from main import trello_secrets
+    U = UserSetup.get_by_id(email)
+    if U is None or not U.trello_token:
+        return
+    token = U.trello_token
+    if board_id is None:
+        key, value = 'boards:%s' % token.get('oauth_token'), _fetch_boards(trello_secrets, token)
+    else:
+        key, value = 'board:%s:%s' % (token.get('oauth_token'), board_id), _fetch_board(trello_secrets, token, board_id)
+    memcache.set(key, (time.time(), value), time=FRESH + STALE, namespace='trello')
+    memcache.delete('refreshing:%s' % key, namespace='trello')
+
+def get_boards(secrets, user):
+    "return the open boards of the UserSetup user, as a list of dicts, see board_dict()"
+    token = user.trello_token
+    return _cached('boards:%s' % token.get('oauth_token'),
+                   lambda: _fetch_boards(secrets, token),
+                   lambda: deferred.defer(refresh, user.key.id()))
+
+def get_board(secrets, user, board_id):
+    "return board_id of the UserSetup user, as a dict, see board_dict()"
+    token = user.trello_token
+    return _cached('board:%s:%s' % (token.get('oauth_token'), board_id),
+                   lambda: _fetch_board(secrets, token, board_id),
+                   lambda: deferred.defer(refresh, user.key.id(), board_id))
@@ -0,0 +1,421 @@
+# encoding: utf-8
+# The MIT License (MIT)
+
+# Copyright (c) 2014-2016 Håvard Gulldahl
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# stdlib stuff
+import datetime, calendar, collections, itertools, operator, logging, bisect, re
+
+# third party stuff
+# install howto in appengine_requirements.txt
+import dateutil.parser, dateutil.tz
+
+# strict RFC3339, the way gcal always sends 'date' and 'dateTime' values
+RFC3339 = re.compile(r'(\d{4})-(\d{2})-(\d{2})'
+                     r'(?:[Tt](\d{2}):(\d{2}):(\d{2})(?:\.\d+)?([Zz]|[+-]\d{2}:\d{2}))?$')
+
+_offsets = {} # '+02:00' -> tzinfo, shared between calls
+_zones = {} # 'Europe/Oslo' -> tzinfo, likewise
+
+def _tzoffset(offset):
+    "return a (cached) fixed offset tzinfo for 'Z' or '+HH:MM'"
+    try:
+        return _offsets[offset]
+    except KeyError:
+        if offset in ('Z', 'z'):
+            tz = dateutil.tz.tzutc()
+        else:
+            sign = -1 if offset[0] == '-' else 1
+            tz = dateutil.tz.tzoffset(None, sign*(int(offset[1:3])*3600 + int(offset[4:6])*60))
+        _offsets[offset] = tz
+        return tz
+
+def timezone(name):
+    "return a (cached) tzinfo for a time zone name from gcal, like u'Europe/Oslo', or None for None or unknown names"
+    if not name:
+        return None
+    try:
+        return _zones[name]
+    except KeyError:
+        tz = _zones[name] = dateutil.tz.gettz(name)
+        if tz is None:
+            logging.warning('timezone: unknown time zone %r', name)
+        return tz
+
+def parse_rfc3339(s, tz=None):
+    """Parse a strict RFC3339 date or date-time string and return datetime.date.
+
+    Raises ValueError on anything else. A date-time gives the date in tz (a tzinfo,
+    see timezone()), or, without tz, the date on the wall clock of its own UTC offset.
+
+    """
+    m = RFC3339.match(s)
+    if m is None:
+        raise ValueError('not an RFC3339 date: %r' % s)
+    year, month, day, hour, minute, second, offset = m.groups()
+    if hour is None or tz is None:
+        return datetime.date(int(year), int(month), int(day))
+    dt = datetime.datetime(int(year), int(month), int(day),
+                           int(hour), int(minute), int(second), tzinfo=_tzoffset(offset))
+    return dt.astimezone(tz).date()
+
+def parse_date(d, tz=None):
+    """Parse {u'date': u'2014-10-10'} or {u'dateTime': u'2014-10-10T12:30:00+02:00'} and return datetime.date
+
+    Takes the strict RFC3339 fast path, and falls back to dateutil for anything else.
+    See parse_rfc3339() for the meaning of tz.
+
+    """
+    if 'date' in d:
+        s = d['date']
+    elif 'dateTime' in d:
+        s = d['dateTime']
+    else:
+        return None
+    try:
+        return parse_rfc3339(s, tz)
+    except ValueError:
+        logging.debug('parse_date: falling back to dateutil for %r', s)
+        dt = dateutil.parser.parse(s, fuzzy=True)
+        if tz is not None and dt.tzinfo is not None:
+            dt = dt.astimezone(tz)
+        return dt.date()
+
+# Without events, the layout of a year only depends on the weekday of 1 jan and
+# whether it is a leap year, so there are only 14 different ones. The ISO week
+# number of the first days of january also depends on whether the year before
+# had 52 or 53 ISO weeks.
+# The layouts are computed once and shared by all requests.
+
+# one day of a year layout
+Day = collections.namedtuple('Day', 'date month year weeknumber weekday yearmonth')
+
+_templates = {} # (weekday of 1 jan, leap year, ISO weeks in year before) -> tuple of per day tuples
+_layouts = {} # year -> tuple of Day
+MAX_LAYOUTS = 200 # years to keep in _layouts
+
+def _layout_template(year):
+    """return the layout of `year` as a tuple of
+    (month, day, ISO year - year, ISO week number, ISO weekday) tuples, one per day"""
+    jan1 = datetime.date(year, 1, 1)
+    variant = (jan1.weekday(), calendar.isleap(year),
+               datetime.date(year-1, 12, 28).isocalendar()[1]) # 28 dec is always in the last ISO week
+    try:
+        return _templates[variant]
+    except KeyError:
+        pass
+    template = []
+    for n in xrange(366 if variant[1] else 365):
+        d = jan1 + datetime.timedelta(days=n)
+        isoyear, weeknumber, weekday = d.isocalendar() # Return a 3-tuple, (ISO year, ISO week number, ISO weekday).
+        template.append( (d.month, d.day, isoyear - year, weeknumber, weekday) )
+    _templates[variant] = template = tuple(template)
+    return template
+
+def year_layout(year):
+    "return the layout of `year` as a tuple of Day, one per day. Cached."
+    try:
+        return _layouts[year]
+    except KeyError:
+        pass
+    ordinal = datetime.date(year, 1, 1).toordinal()
+    yearmonths = [None] + ['%04d-%02d' % (year, m) for m in range(1, 13)]
+    layout = tuple(Day(datetime.date.fromordinal(ordinal + n), month, year + isodelta, weeknumber, weekday,
+                       yearmonths[month])
+                   for (n, (month, day, isodelta, weeknumber, weekday))
+                   in enumerate(_layout_template(year)))
+    if len(_layouts) >= MAX_LAYOUTS:
+        _layouts.clear()
+    _layouts[year] = layout
+    return layout
+
+class Date(object):
+    "A day in the calendar: a view of a shared Day from year_layout(), plus the events of the day"
+    __slots__ = ('day', 'events')
+    def __init__(self, day, events):
+        self.day = day # Day
+        self.events = events # list
+
+    date = property(lambda self: self.day.date) # datetime.date
+    month = property(lambda self: self.day.month)
+    year = property(lambda self: self.day.year) # ISO year
+    weeknumber = property(lambda self: self.day.weeknumber) # ISO week number
+    weekday = property(lambda self: self.day.weekday) # ISO weekday, 1 == Monday
+    yearmonth = property(lambda self: self.day.yearmonth) # '%Y-%m'
+
+def color_class(colorId, calendarColorId=None):
+    "the colors.css class of an event with colorId, from a calendar with calendarColorId"
+    if colorId is not None:
+        return 'color-event-%s' % colorId
+    if calendarColorId is not None:
+        return 'color-calendar-%s' % calendarColorId
+    return 'color-event-default'
+
+class Event(object):
+    """High level access to the dict returned from gcal.
+
+    Only the fields the views need are kept, not the dict itself. The whole
+    event can be fetched when it is needed, see main.EventHandler.
+
+    """
+    __slots__ = ('startdate', 'enddate', 'days', 'summary', 'colorId', 'calendarColorId',
+                 'calendarId', 'iCalUID', 'id', 'slug')
+    def __init__(self, gcaldict, startdate=None, enddate=None): # parse a dict from gcal
+        #logging.info('Event from %s', gcaldict)
+        self.startdate = startdate or parse_date(gcaldict['start']) # get datetime.date
+        self.enddate = enddate or parse_date(gcaldict['end']) # get datetime.date
+        self.days = max(1, (self.enddate-self.startdate).days) # integer, at least 1
+        self.summary = gcaldict['summary']
+        self.colorId = gcaldict.get('colorId', None)
+        self.calendarColorId = gcaldict.get('_calendarColorId', None) # set when several calendars are merged
+        self.calendarId = gcaldict.get('_calendarId', None) # likewise
+        self.iCalUID = gcaldict.get('iCalUID', None)
+        self.id = gcaldict.get('id', None)
+        self.slug = self.slugify(self.summary, self.days)
+
+    @classmethod
+    def from_items(cls, items, tz=None):
+        """Make Events from a list of gcal dicts, parsing every distinct start and end value only once.
+        The dates are in tz, see parse_rfc3339()"""
+        _parsed = {}
+        def _date(d):
+            s = d.get('date') or d.get('dateTime')
+            try:
+                return _parsed[s]
+            except KeyError:
+                _parsed[s] = v = parse_date(d, tz)
+                return v
+        return [cls(e, _date(e['start']), _date(e['end'])) for e in items]
+
+    def slugify(self, s, span):
+        'Shorten a string according to available span'
+        SLUGLENGTH=int(30*span)
+        if len(s) < SLUGLENGTH:
+            return s
+        return u'%s..' % s[:SLUGLENGTH]
+    def color_class(self):
+        "the colors.css class of the event: its own color, or the color of the calendar it came from"
+        return color_class(self.colorId, self.calendarColorId)
+    def multiple_days(self):
+        return self.days > 1
+    def segments(self):
+        "return a list of Segment, one for every month the event is in"
+        _segments = []
+        start = self.startdate
+        end = start + datetime.timedelta(days=self.days)
+        while start < end:
+            if start.month == 12:
+                nextmonth = datetime.date(start.year+1, 1, 1)
+            else:
+                nextmonth = datetime.date(start.year, start.month+1, 1)
+            stop = min(end, nextmonth)
+            _segments.append(Segment(self, start, (stop-start).days))
+            start = stop
+        return _segments
+
+class Segment(object):
+    """The part of an Event that is inside one month of the calendar.
+
+    Everything but startdate, days and slug is looked up on the Event.
+
+    """
+    __slots__ = ('event', 'startdate', 'days')
+    def __init__(self, event, startdate, days):
+        self.event = event # Event
+        self.startdate = startdate # datetime.date
+        self.days = days # integer, days of the event in this month
+
+    def __getattr__(self, name):
+        return getattr(self.event, name)
+
+    @property
+    def slug(self):
+        if self.days == self.event.days:
+            return self.event.slug
+        return self.event.slugify(self.event.summary, self.days)
+
+    def continued(self):
+        "True if the event started in an earlier month"
+        return self.startdate != self.event.startdate
+
+class YearCalendar(calendar.Calendar):
+    "Super Class of calendar.Calendar to display a year with events"
+    def __init__(self, cal_id, events, firstweekday=None, tz=None):
+        super(YearCalendar, self).__init__(firstweekday=firstweekday or 0) # 0 == Monday
+        self.id = cal_id
+        # logging.info('eents:%s', events)
+        # events are gcal dicts, with their dates in tz, or Events already made with Event.from_items()
+        if events and not isinstance(events[0], Event):
+            events = Event.from_items(events, tz)
+        # split every event in one Segment per month it is in, so events that
+        # span several months are shown in all of them
+        _e = []
+        for E in events:
+            for S in E.segments():
+                _e.append( (S.startdate, S) )
+        # index the events once, so lookups don't scan the whole list for every day
+        # stable, keeps gcal order within a day, after the events continued from last month
+        _e.sort(key=lambda ev: (ev[0], not ev[1].continued()))
+        self.events = _e
+        self._eventdates = [evdate for (evdate, E) in _e] # sorted, for bisect range lookups
+        self._index = {} # datetime.date -> list of events
+        for (evdate, E) in _e:
+            try:
+                self._index[evdate].append(E)
+            except KeyError:
+                self._index[evdate] = [E,]
+
+    def iterdates(self, startdate=None, enddate=None):
+        """iterate over all dates from startdate up to enddate, defaulting to all of the current year.
+
+        startdate and enddate can be None, datetime.date or dict instance from gcal
+
+        """
+        logging.debug('iterdates: start %s - > end %s', startdate, enddate)
+        _thisyear = datetime.datetime.now().year
+        if startdate is None:
+            startdate = datetime.date(_thisyear, 1, 1)
+        elif isinstance(startdate, dict):
+            startdate = parse_date(startdate)
+        if enddate is None:
+            enddate = datetime.date(_thisyear+1, 1, 1)
+        elif isinstance(enddate, dict):
+            enddate = parse_date(enddate)
+
+        for year in xrange(startdate.year, enddate.year + 1):
+            layout = year_layout(year)
+            jan1 = layout[0].date
+            first = (startdate - jan1).days if year == startdate.year else 0
+            last = (enddate - jan1).days if year == enddate.year else len(layout)
+            for day in layout[first:last]:
+                yield Date(day, self.get_events(day.date))
+
+    def dates(self, startdate=None, enddate=None):
+        """iterate over all dates grouped by month, yielding ('%Y-%m', [Date, ...]) tuples.
+
+        Only one month of Date objects is alive at a time.
+
+        """
+        for yearmonth, days in itertools.groupby(self.iterdates(startdate, enddate),
+                                                 key=operator.attrgetter('yearmonth')):
+            yield yearmonth, list(days)
+
+    def get_events(self, date):
+        "return a list of all event Segments that start on a specific datetime.date"
+        return self._index.get(date, [])
+
+    def events_between(self, startdate=None, enddate=None):
+        "return all (datetime.date, Segment) tuples where startdate <= date < enddate"
+        lo, hi = 0, len(self._eventdates)
+        if startdate is not None:
+            lo = bisect.bisect_left(self._eventdates, startdate)
+        if enddate is not None:
+            hi = bisect.bisect_left(self._eventdates, enddate, lo)
+        return self.events[lo:hi]
+
+    def by_color(self, startdate=None, enddate=None):
+        "return a dict of all events keyed by color, every Event once"
+        _r = {}
+        _seen = set()
+        for (evdate, S) in self.events_between(startdate, enddate):
+            e = S.event
+            if e in _seen:
+                continue
+            _seen.add(e)
+            try:
+                _r[e.colorId].append(e)
+            except KeyError:
+                _r[e.colorId] = [e,]
+        return _r
+
+def busy_stats(starts, ends, classes, startdate, enddate):
+    """Count the events of every day and ISO week from startdate to enddate (exclusive), and per color.
+
+    starts and ends are the [start, end) date ordinals of the events, and classes
+    their colors.css classes, see color_class(). An event is at least one day long.
+    Everything is done on numpy arrays, with prefix sums instead of per day loops.
+
+    Returns a dict, ready for json:
+      start, end: startdate and enddate, isoformat
+      days: the number of events on every day, from startdate
+      weeks: [{year, week, monday, events, eventdays}, ...] per ISO week, where
+             events is the number of events in the week and eventdays the sum of days
+      colors: {class: {events, eventdays}}
+      events, eventdays, busiest (date), max, mean, free (days without events)
+
+    """
+    import numpy # only needed here, and slow to import, so not on every cold start
+    lo, hi = startdate.toordinal(), enddate.toordinal()
+    n = hi - lo
+    if n <= 0:
+        raise ValueError('busy_stats: %s is not after %s' % (enddate, startdate))
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    ends = numpy.maximum(numpy.asarray(ends, dtype=numpy.int64), starts + 1)
+    # the part of every event that is inside the range, as day indexes from startdate
+    s = numpy.clip(starts, lo, hi) - lo
+    e = numpy.clip(ends, lo, hi) - lo
+    inside = e > s
+    s, e = s[inside], e[inside]
+    lengths = e - s
+    offset = startdate.weekday()
+    nweeks = (offset + n + 6) // 7
+    if not len(s):
+        # nothing to count. numpy 1.6 bincount() raises ValueError on empty arrays and minlength=0
+        days = numpy.zeros(n, dtype=numpy.int64)
+        weeks = weekdays = numpy.zeros(nweeks, dtype=numpy.int64)
+        names, color_events, color_days = [], [], []
+    else:
+        # +1 on the first day of every event, -1 on the day after the last. The running sum is the events per day
+        days = numpy.cumsum(numpy.bincount(s, minlength=n+1) - numpy.bincount(e, minlength=n+1))[:n]
+        # weeks are counted the same way, from the monday on or before startdate
+        first_week, last_week = (s + offset) // 7, (e - 1 + offset) // 7
+        weeks = numpy.cumsum(numpy.bincount(first_week, minlength=nweeks+1) -
+                             numpy.bincount(last_week + 1, minlength=nweeks+1))[:nweeks]
+        padded = numpy.zeros(nweeks * 7, dtype=numpy.int64)
+        padded[offset:offset+n] = days
+        weekdays = padded.reshape(nweeks, 7).sum(axis=1)
+        # colors, numbered in order of appearance (a dict is faster than numpy.unique on strings)
+        _codes = {}
+        codes = numpy.asarray([_codes.setdefault(c, len(_codes)) for c in classes], dtype=numpy.int64)[inside]
+        names = sorted(_codes, key=_codes.get)
+        color_events = numpy.bincount(codes, minlength=len(names))
+        color_days = numpy.bincount(codes, weights=lengths, minlength=len(names))
+
+    monday = lo - offset
+    _weeks = []
+    for (i, (count, eventdays)) in enumerate(zip(weeks.tolist(), weekdays.tolist())):
+        d = datetime.date.fromordinal(monday + 7*i)
+        year, week, weekday = d.isocalendar()
+        _weeks.append({'year': year, 'week': week, 'monday': d.isoformat(),
+                       'events': count, 'eventdays': eventdays})
+    return {'start': startdate.isoformat(),
+            'end': enddate.isoformat(),
+            'days': days.tolist(),
+            'weeks': _weeks,
+            'colors': dict((name, {'events': int(c), 'eventdays': int(d)})
+                           for (name, c, d) in zip(names, color_events, color_days) if c),
+            'events': int(inside.sum()),
+            'eventdays': int(lengths.sum()),
+            'busiest': datetime.date.fromordinal(lo + int(days.argmax())).isoformat(),
+            'max': int(days.max()),
+            'mean': round(float(days.mean()), 3),
+            'free': int((days == 0).sum()),
+           }